@@ -1,12 +1,37 @@
+import __future__
+import logging
 import numpy as np
+from itertools import product
+from multiprocessing import Pool
 from PyscesToolBox import PyscesToolBox as PYCtools
-from sympy import Symbol
+from sympy import Add, Symbol, lambdify, cse, numbered_symbols
+from sympy.printing.lambdarepr import NumPyPrinter
+from ModelValues import ModelValues
+
+
+# The control coefficient scanned by the current CCoef.parscan worker
+# process. It is passed to each worker by the initializer of its pool,
+# so that every worker has its own copy of the CC object and its model.
+_scan_cc = None
+
+# log|x| used for symbols with the value 0 (exp() of it is 0)
+_LOG_ZERO = -745.0
+
+
+def _init_scan_worker(cc):
+    global _scan_cc
+    _scan_cc = cc
+
+
+def _scan_chunk(args):
+    parameter, chunk = args
+    return _scan_cc._scan_values(parameter, chunk)
 
 
 class CCBase(object):
     """The base object for the control coefficients and control patterns"""
 
-    def __init__(self, mod, name, expression):
+    def __init__(self, mod, name, expression, symbols=None, values=None):
         super(CCBase, self).__init__()
 
         self.expression = expression
@@ -14,11 +39,33 @@ class CCBase(object):
         self.name = name
         self._latex_name = '\\Sigma'
 
+        # The ordered argument vector of the compiled expression. CC
+        # objects of the same model share it so that the argument values
+        # only have to be collected once for all of them.
+        if symbols is None:
+            symbols = sorted(expression.atoms(Symbol), key=str)
+        self.symbols = tuple(symbols)
+        # reads the values of self.symbols from the model (see
+        # ModelValues), also shared by the CC objects of a model
+        if values is None:
+            values = ModelValues(mod)
+        self.model_values = values
+
         self._value = None
+        # the model generation (see ModelValues.generation) of _value
+        self._generation = None
         self._latex_expression = None
+        self._function = None
         
         
 
+    def __getstate__(self):
+        # compiled functions cannot be pickled (e.g. for a worker
+        # process), they are compiled again when needed
+        state = self.__dict__.copy()
+        state['_function'] = None
+        return state
+
     @property
     def latex_expression(self):
         if not self._latex_expression:
@@ -33,28 +80,98 @@ class CCBase(object):
 
     @property
     def value(self):
-        """The value property. Calls self._calc_value() when self._value
-        is None and returns self._value"""
-        if not self._value:
+        """The value property. The value is calculated once per state of
+        the model (see ModelValues.generation)"""
+        return self._value_at(self.model_values.generation)
+
+    def _value_at(self, generation):
+        """Returns the value at the model generation, which has to be
+        the current one. Calls self._calc_value() if the value is not
+        known for this generation"""
+        if self._value is None or self._generation != generation:
             self._calc_value()
         return self._value
 
+    def _set_value(self, value, generation):
+        self._value = value
+        self._generation = generation
+
     def _calc_value(self):
         """Calculates the value of the expression"""
-        symbols = self.expression.atoms(Symbol)
-        subsdic = {}
-        for symbol in symbols:
-            subsdic[symbol] = getattr(self.mod, str(symbol))
-        self._value = self.expression.subs(subsdic)
+        generation = self.model_values.generation
+        self._set_value(self._evaluate(self._argument_values()), generation)
+
+    def _argument_values(self):
+        """Returns the current model values of self.symbols"""
+        return self.model_values.values(self.symbols)
+
+    def _evaluate(self, args):
+        """Evaluates the compiled expression for the argument values args
+        (ordered as self.symbols)"""
+        self._compile()
+        return self._function(*args)
+
+    def _compile(self):
+        if not self._function:
+            self._function = lambdify(self.symbols, self.expression, 'numpy')
+
+    def _grid_arguments(self, parameters, scan_ranges, init_return=False):
+        """Returns an array with the argument values (rows ordered as
+        self.symbols) at every point (columns) of the grid spanned by
+        scan_ranges, in the order of _grid_rows"""
+        rows = [args for index, args in
+                self._grid_rows(parameters, scan_ranges, init_return)]
+        if not rows:
+            return np.zeros((len(self.symbols), 0))
+        return np.hstack(rows)
 
+    def _grid_rows(self, parameters, scan_ranges, init_return=False):
+        """Yields a tuple (index, args) for every row of the grid spanned
+        by scan_ranges along the last parameter. index holds the
+        positions of the other parameters in their ranges and args is
+        an array with the argument values (rows ordered as
+        self.symbols) at every value of the last parameter (columns).
+        The other parameters are only set once per row."""
+        init = [getattr(self.mod, parameter) for parameter in parameters]
+        outer = product(*[range(len(r)) for r in scan_ranges[:-1]])
+        try:
+            for index in outer:
+                for i, position in enumerate(index):
+                    setattr(self.mod, parameters[i], scan_ranges[i][position])
+                args = []
+                for parvalue in scan_ranges[-1]:
+                    setattr(self.mod, parameters[-1], parvalue)
+                    self.mod.SetQuiet()
+                    self.mod.doMca()
+                    self.mod.SetLoud()
+                    args.append(self._argument_values())
+                args = np.array(args, dtype=np.float).reshape(
+                    len(args),
+                    len(self.symbols)
+                )
+                yield index, args.transpose()
+        finally:
+            if init_return:
+                for parameter, value in zip(parameters, init):
+                    setattr(self.mod, parameter, value)
+            # the model is left at the steady state of the last point
+            self.model_values.changed()
     
 
 
 class CCoef(CCBase):
     """The object the stores control coefficients. Inherits from CCBase"""
 
-    def __init__(self, mod, name, expression, denominator):
-        super(CCoef, self).__init__(mod, name, expression)
+    def __init__(self, mod, name, expression, denominator, symbols=None,
+                 values=None):
+        if symbols is None:
+            symbols = sorted(
+                expression.atoms(Symbol) |
+                denominator.expression.atoms(Symbol),
+                key=str
+            )
+        super(CCoef, self).__init__(mod, name, expression, symbols,
+                                    values)
         self.numerator = expression
         self.denominator = denominator.expression
         self.expression = self.numerator / denominator.expression
@@ -65,7 +182,29 @@ class CCoef(CCBase):
         self._latex_expression =  None
         self._latex_name = None
 
-        self._control_patterns = None
+        # the control patterns (see _split_patterns) and their values
+        self._terms = None
+        self._coefficient_indices = None
+        self._term_indices = None
+        self._pattern_values = None
+        self._percentages = None
+        self._patterns_function = None
+        # the exponents of the pattern terms (see _set_exponents) and
+        # the compiled functions of top_parscan
+        self._exponents = None
+        self._top_functions = {}
+        # (log|x|, log|pattern term|) at the last state at which
+        # top_patterns evaluated all terms
+        self._reference = None
+
+        # a CCEvaluator shared by all control coefficients of the model
+        self.evaluator = None
+
+    def __getstate__(self):
+        state = super(CCoef, self).__getstate__()
+        state['_patterns_function'] = None
+        state['_top_functions'] = {}
+        return state
 
     @property
     def latex_numerator(self):
@@ -102,12 +241,58 @@ class CCoef(CCBase):
 
     @property
     def control_patterns(self):
-        if not self._control_patterns:
-            self._set_control_patterns()
-        return self._control_patterns
+        """The control patterns as a list of CPattern views, which are
+           created on demand"""
+        self._split_patterns()
+        return [CPattern(self, i) for i in xrange(len(self._term_indices))]
 
+    @property
+    def pattern_count(self):
+        self._split_patterns()
+        return len(self._term_indices)
 
-    def parscan(self, parameter, scan_range, init_return=False):
+    @property
+    def percentages(self):
+        """An array with the percentage contribution of each control
+           pattern, calculated once per model state"""
+        values = self._pattern_values_at(self.model_values.generation)
+        if self._percentages is None:
+            self._percentages = values / values.sum() * 100
+        return self._percentages
+
+    def __getattr__(self, name):
+        # only called for names that are not normal attributes; the
+        # control patterns are available as CP1, CP2, ...
+        if name.startswith('CP') and name[2:].isdigit():
+            index = int(name[2:]) - 1
+            if 0 <= index < self.pattern_count:
+                return CPattern(self, index)
+        raise AttributeError(name)
+
+    def memory_usage(self):
+        """Returns a dictionary with the number of control patterns
+           ('patterns'), the number of distinct terms they use ('terms',
+           stored once in the TermTable shared by the control
+           coefficients of the model) and the number of bytes used by
+           the arrays of this control coefficient ('bytes')"""
+        self._split_patterns()
+        arrays = [
+            self._coefficient_indices,
+            self._term_indices,
+            self._pattern_values,
+            self._percentages
+        ]
+        if self._exponents:
+            arrays.extend(self._exponents)
+        if self._reference:
+            arrays.extend(self._reference)
+        return {
+            'patterns': len(self._term_indices),
+            'terms': len(np.unique(self._term_indices)),
+            'bytes': sum(a.nbytes for a in arrays if a is not None),
+        }
+
+    def parscan(self, parameter, scan_range, init_return=False, workers=1):
         """Performs a parameter scan and returns numpy array object
            with the parameter values in the first column and
            percentage contribution of each control pattern
@@ -116,119 +301,736 @@ class CCoef(CCBase):
            Arguments:
            parameter   --  the parameter of the model to scan
            scan_range  --  the range across which to scan 'parameter'
+           init_return --  reset 'parameter' to its initial value after
+                           a serial scan
+           workers     --  the number of processes to use. With more
+                           than one process scan_range is split into
+                           chunks that are scanned by worker processes,
+                           each with its own copy of this object and its
+                           model, and the model of this object is not
+                           changed at all
 
-           calls self._recalculate_value() for each value of
-           parameter in scan_range"""
-        scan_res = [list() for i in range(len(self.control_patterns) + 1)]
-        scan_res[0] = scan_range
+           The argument values of every scan point are collected first,
+           after which all control patterns are evaluated for all
+           points in a single array operation"""
+        if len(scan_range) == 0:
+            return np.zeros((0, self.pattern_count + 1))
+        if workers > 1:
+            values = self._parallel_scan_values(parameter, scan_range, workers)
+        else:
+            init = getattr(self.mod, parameter)
+            values = self._scan_values(parameter, scan_range)
 
-        #print type(scan_res)
-        init = getattr(self.mod, parameter)
-        for parvalue in scan_range:
-            setattr(self.mod, parameter, parvalue)
-            self.mod.SetQuiet()
-            self.mod.doMca()
-            self.mod.SetLoud()
+            if init_return:
+                setattr(self.mod, parameter, init)
 
-            self._recalculate_value()
-            for i, cp in enumerate(self.control_patterns):
-                #print type(scan_res[i+1])
-                scan_res[i + 1].append(cp.percentage)
+            # leave the values of the last scan point, as before
+            self._set_pattern_values(
+                np.array(values[:, -1]),
+                self.model_values.generation
+            )
+
+        percentages = values / values.sum(axis=0) * 100
+
+        scan_res = np.vstack([np.array(scan_range, dtype=np.float),
+                              percentages])
+        return scan_res.transpose()
+
+    def top_patterns(self, k):
+        """Returns the k control patterns with the largest absolute
+           values at the current model state, largest first.
 
-        if init_return:
-            setattr(self.mod, parameter, init)
+           The patterns are ranked by the magnitude of their terms (the
+           denominator is the same for all of them). The first call
+           evaluates all terms. Later calls calculate an upper bound of
+           every magnitude from the change of the symbol values since
+           then and from the largest and smallest elasticity, flux and
+           species values (see _log_bounds). The terms are evaluated in
+           the order of their bounds until no remaining bound can beat
+           the k-th largest value, so while the model state changes
+           little (e.g. during a scan) most terms of a large control
+           coefficient are not evaluated"""
+        self._split_patterns()
+        count = len(self._term_indices)
+        k = min(k, count)
+        if k <= 0:
+            return []
 
-        return np.array(scan_res, dtype=np.float).transpose()
+        if not self._set_exponents():
+            # terms that are not products of powers of symbols
+            values = self._pattern_values_at(self.model_values.generation)
+            order = np.argsort(-np.abs(values), kind='mergesort')
+            return [CPattern(self, int(i)) for i in order[:k]]
+
+        logs = self._log_arguments()
+        if self._reference is None:
+            bounds = np.zeros(count)
+            order = np.arange(count)
+            batch = count
+        else:
+            bounds = self._log_bounds(logs)
+            order = np.argsort(-bounds, kind='mergesort')
+            batch = max(k, 32)
+
+        term_logs = np.empty(count)
+        best = np.zeros(0, dtype=int)
+        evaluated = 0
+        while evaluated < count:
+            chunk = order[evaluated:evaluated + batch]
+            evaluated += len(chunk)
+            term_logs[chunk] = self._log_terms(chunk, logs)
+            candidates = np.concatenate((best, chunk))
+            keep = np.argsort(-term_logs[candidates], kind='mergesort')[:k]
+            best = candidates[keep]
+            if (evaluated < count and
+                    term_logs[best[-1]] >= bounds[order[evaluated]]):
+                break
+        if evaluated == count:
+            self._reference = (logs, term_logs)
+
+        logging.debug('%s: top %d patterns, %d of %d terms evaluated'
+                      % (self.name, k, evaluated, count))
+        return [CPattern(self, int(i)) for i in best]
+
+    def top_parscan(self, parameter, scan_range, k, init_return=False):
+        """Performs a parameter scan that only tracks the k dominant
+           control patterns at the current model state (see
+           top_patterns). Returns a tuple (patterns, scan_res) where
+           patterns are these control patterns and scan_res is an array
+           with the parameter values in the first column and the
+           percentage contribution of each pattern in the subsequent
+           columns.
+
+           The percentages are relative to the whole control
+           coefficient, whose numerator is summed from the term values
+           of the evaluator (see _scan_numerators). Only the terms of
+           the k patterns are compiled into a function of their own"""
+        patterns = self.top_patterns(k)
+        indices = [pattern.index for pattern in patterns]
+        args = self._grid_arguments([parameter], [scan_range], init_return)
+
+        function = self._top_functions.get(tuple(indices))
+        if function is None:
+            function = lambdify(
+                self.symbols,
+                [self._terms.terms[i] for i in self._term_indices[indices]],
+                'numpy'
+            )
+            self._top_functions[tuple(indices)] = function
+        numerators = self._scan_numerators(args)
+        # constant terms are returned as scalars
+        arrays = np.broadcast_arrays(numerators, *function(*args))
+        terms = np.array(arrays[1:], dtype=np.float).reshape(
+            (len(indices),) + numerators.shape
+        )
+        coefficients = self._terms.coefficient_values()
+        coefficients = coefficients[self._coefficient_indices[indices]]
+        percentages = coefficients[:, np.newaxis] * terms / numerators * 100
+
+        scan_res = np.vstack([np.array(scan_range, dtype=np.float),
+                              percentages])
+        return patterns, scan_res.transpose()
+
+    def _scan_numerators(self, args):
+        """Returns the numerator of the control coefficient for the
+           argument values args (one array of values per symbol). The
+           terms are taken from the evaluator (or from the function of
+           _compile_patterns) and weighted by the coefficients of the
+           patterns that use them, so the pattern values are not
+           stored"""
+        if self.evaluator:
+            values = self.evaluator.values(args)
+            self._split_patterns()
+            terms = values[1:]
+        else:
+            self._compile_patterns()
+            arrays = np.broadcast_arrays(*self._patterns_function(*args))
+            terms = np.array(arrays[1:], dtype=np.float).reshape(
+                (len(arrays) - 1,) + arrays[0].shape
+            )
+        coefficients = self._terms.coefficient_values()
+        weights = np.bincount(
+            self._term_indices,
+            weights=coefficients[self._coefficient_indices],
+            minlength=len(terms)
+        )
+        return weights.dot(terms)
+
+    def _set_exponents(self):
+        """Stores the exponents of the pattern terms in
+           self._exponents, a tuple (start, symbols, powers, positive,
+           negative) of arrays: the powers of the symbols (indices into
+           self.symbols) of pattern i are entries start[i] to
+           start[i + 1] of symbols and powers. positive and negative
+           hold the sum of the positive and of the (absolute) negative
+           powers of each pattern per kind of symbol (see
+           _symbol_kinds). Returns False if a term is not a product of
+           integer powers of symbols"""
+        if self._exponents is None:
+            position = dict((s, i) for i, s in enumerate(self.symbols))
+            kinds = self._symbol_kinds()
+            count = len(self._term_indices)
+            start = [0]
+            symbols = []
+            powers = []
+            positive = np.zeros((count, 3), dtype=np.int16)
+            negative = np.zeros((count, 3), dtype=np.int16)
+            for i, term_index in enumerate(self._term_indices):
+                term = self._terms.terms[term_index]
+                for base, power in term.as_powers_dict().items():
+                    if base == 1:
+                        continue
+                    if base not in position or not power.is_Integer:
+                        self._exponents = False
+                        return False
+                    symbols.append(position[base])
+                    powers.append(int(power))
+                    kind = kinds[position[base]]
+                    if power > 0:
+                        positive[i, kind] += int(power)
+                    else:
+                        negative[i, kind] -= int(power)
+                start.append(len(symbols))
+            self._exponents = (
+                np.array(start, dtype=np.int32),
+                np.array(symbols, dtype=np.int32),
+                np.array(powers, dtype=np.int16),
+                positive,
+                negative
+            )
+        return self._exponents is not False
+
+    def _symbol_kinds(self):
+        """0 for elasticities, 1 for fluxes and 2 for the other symbols
+           (species) in self.symbols"""
+        kinds = []
+        for symbol in self.symbols:
+            name = str(symbol)
+            if name.startswith('ec'):
+                kinds.append(0)
+            elif name.startswith('J_'):
+                kinds.append(1)
+            else:
+                kinds.append(2)
+        return np.array(kinds, dtype=int)
+
+    def _log_arguments(self):
+        """log|x| of the current values of self.symbols"""
+        values = np.abs(np.asarray(self._argument_values(), dtype=np.float))
+        logs = np.empty(len(values))
+        zero = values == 0
+        logs[zero] = _LOG_ZERO
+        logs[~zero] = np.log(values[~zero])
+        return logs
+
+    def _log_coefficients(self, patterns):
+        coefficients = self._terms.coefficient_values()
+        return np.log(np.abs(
+            coefficients[self._coefficient_indices[patterns]]
+        ))
+
+    def _log_bounds(self, logs):
+        """Upper bounds of log|pattern term| of all patterns for the
+           symbol values exp(logs). The smaller one of two bounds is
+           used: the value at the reference state (see top_patterns)
+           increased by the largest change of log|x| of each kind of
+           symbol times the degree of the term in that kind, and the
+           value with every symbol replaced by the largest value of its
+           kind where its power is positive and by the smallest one
+           where it is negative"""
+        start, symbols, powers, positive, negative = self._exponents
+        kinds = self._symbol_kinds()
+        reference_logs, reference_terms = self._reference
+        changes = np.abs(logs - reference_logs)
+        largest = np.zeros(3)
+        smallest = np.zeros(3)
+        change = np.zeros(3)
+        for kind in range(3):
+            of_kind = kinds == kind
+            if of_kind.any():
+                largest[kind] = logs[of_kind].max()
+                smallest[kind] = logs[of_kind].min()
+                change[kind] = changes[of_kind].max()
+        patterns = np.arange(len(self._term_indices))
+        extremes = (self._log_coefficients(patterns) +
+                    positive.dot(largest) - negative.dot(smallest))
+        changed = reference_terms + (positive + negative).dot(change)
+        return np.minimum(extremes, changed)
+
+    def _log_terms(self, patterns, logs):
+        """log|pattern term| of the patterns (indices) for the symbol
+           values exp(logs)"""
+        start, symbols, powers, positive, negative = self._exponents
+        lengths = start[patterns + 1] - start[patterns]
+        offsets = np.cumsum(lengths) - lengths
+        entries = (np.repeat(start[patterns], lengths) +
+                   np.arange(lengths.sum()) - np.repeat(offsets, lengths))
+        rows = np.repeat(np.arange(len(patterns)), lengths)
+        sums = np.bincount(
+            rows,
+            weights=powers[entries] * logs[symbols[entries]],
+            minlength=len(patterns)
+        )
+        return self._log_coefficients(patterns) + sums
+
+    def _scan_values(self, parameter, scan_range):
+        """Sets 'parameter' to each value in scan_range and returns the
+           control pattern values at every point (see _evaluate_patterns)"""
+        args = self._grid_arguments([parameter], [scan_range])
+        return self._evaluate_patterns(args)
+
+    def gridscan(self, parameters, scan_ranges, init_return=False):
+        """Performs a scan over the grid spanned by several parameters
+           and returns the percentage contribution of each control
+           pattern at every grid point.
+
+           Arguments:
+           parameters  --  a list of model parameters to scan
+           scan_ranges --  a list with the range of each parameter
+           init_return --  reset the parameters to their initial values
+                           after the scan
+
+           The result has the shape (len(scan_ranges[0]), ...,
+           len(scan_ranges[-1]), number of control patterns) so that
+           result[i, j, k] holds the percentages of all patterns at
+           the point (scan_ranges[0][i], scan_ranges[1][j],
+           scan_ranges[2][k])
+
+           The grid is scanned one row along the last parameter at a
+           time and the control patterns are evaluated for all points
+           of a row with a single call of the compiled function"""
+        shape = tuple(len(r) for r in scan_ranges)
+        result = np.empty(shape + (self.pattern_count,))
+        for index, args in self._grid_rows(parameters, scan_ranges,
+                                           init_return):
+            result[index] = self._row_percentages(args)
+        return result
+
+    def _row_percentages(self, args):
+        """Evaluates the control patterns for the argument values args of
+           a row of the grid (see _grid_rows) and returns their
+           percentages with a row for every point"""
+        values = self._evaluate_patterns(args)
+        percentages = values / values.sum(axis=0) * 100
+        return percentages.transpose()
+
+    def _parallel_scan_values(self, parameter, scan_range, workers):
+        """Same as _scan_values but splits scan_range into chunks that
+           are scanned by worker processes. Each worker gets its own copy
+           of this object from the initializer of the pool. Forked
+           workers share the compiled functions, otherwise (see
+           __getstate__) the source of the compiled evaluator is passed
+           on, so the workers do not repeat the common subexpression
+           elimination. The results are joined in the order of
+           scan_range"""
+        chunks = [(parameter, chunk) for chunk in
+                  np.array_split(np.array(scan_range, dtype=np.float), workers)
+                  if len(chunk) != 0]
+
+        self._compile_patterns()
+        pool = Pool(
+            len(chunks),
+            initializer=_init_scan_worker,
+            initargs=(self,)
+        )
+        try:
+            results = pool.map(_scan_chunk, chunks)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        return np.hstack(results)
 
     def _recalculate_value(self):
         """Recalculates the control coefficients and control pattern
-           values. calls _calc_value() for self and each control
-           pattern. Useful for when model parameters change"""
-        for pattern in self.control_patterns:
-            pattern._calc_value()
-            self._calc_value()
+           values. The argument values are collected once and the
+           numerators of all control patterns are evaluated with a single
+           call of a compiled function. Useful for when model parameters
+           change"""
+        generation = self.model_values.generation
+        args = self._argument_values()
+        self._set_pattern_values(self._evaluate_patterns(args), generation)
 
     def _calc_value(self):
-        """Calculates the numeric value of the control pattern from the
-           values of its control patterns."""
-        self._value = sum([pattern.value for pattern in self.control_patterns])
-
-    def _set_control_patterns(self):
-        """Divides control coefficient into control pattens and saves
-           results in self.CPx where x is a number is the number of the
-           control pattern as it appears in in control coefficient
-           expression"""
-        pattens = self.numerator.as_coeff_add()[1]
-        cps = []
-        for i, pattern in enumerate(pattens):
-            name = 'CP' + str(1 + i)
-            cp = CPattern(self.mod, name, pattern, self.denominator_object, self)
-            setattr(self, name, cp)
-            cps.append(cp)
-        self._control_patterns = cps
-        #assert self._check_control_patterns == True
+        """Calculates the numeric value of the control coefficient from
+           the values of its control patterns. With an evaluator the
+           values of all control coefficients of the model are set at
+           once."""
+        if self.evaluator:
+            self.evaluator.update()
+        else:
+            self._recalculate_value()
+
+    def _pattern_values_at(self, generation):
+        """Returns the array of control pattern values at the model
+           generation (see CCBase._value_at)"""
+        if self._pattern_values is None or self._generation != generation:
+            self._calc_value()
+        return self._pattern_values
+
+    def _set_pattern_values(self, values, generation):
+        self._pattern_values = values
+        self._percentages = None
+        self._set_value(values.sum(), generation)
+
+    def _evaluate_patterns(self, args):
+        """Returns an array with the values of the control patterns for
+           the argument values args (ordered as self.symbols). When each
+           argument is an array of values (one per scan point) the
+           result has a row for every control pattern and a column for
+           every point"""
+        if self.evaluator:
+            return self.evaluator.pattern_values(self, args)
+
+        self._compile_patterns()
+        # the denominator followed by the terms, constants as scalars
+        arrays = np.broadcast_arrays(*self._patterns_function(*args))
+        terms = np.array(arrays[1:], dtype=np.float).reshape(
+            (len(arrays) - 1,) + arrays[0].shape
+        )
+        return self._combine(terms, arrays[0])
+
+    def _combine(self, terms, denominator):
+        """Returns the control pattern values from the values of the
+           terms in self._terms (one row per term) and the value of the
+           common denominator"""
+        coefficients = self._terms.coefficient_values()
+        coefficients = coefficients[self._coefficient_indices]
+        coefficients = coefficients.reshape(
+            coefficients.shape + (1,) * (terms.ndim - 1)
+        )
+        return coefficients * terms[self._term_indices] / denominator
+
+    def _compile_patterns(self):
+        """Compiles the denominator and the terms of all control patterns
+           into a single function of self.symbols (the symbols of the
+           denominator object may be ordered differently)"""
+        if self.evaluator:
+            self.evaluator._compile()
+        elif not self._patterns_function:
+            self._split_patterns()
+            self._patterns_function = lambdify(
+                self.symbols,
+                [self.denominator] + self._terms.terms,
+                'numpy'
+            )
+
+    def _split_patterns(self, table=None):
+        """Divides the control coefficient into control patterns. Each
+           pattern is stored as the index of its coefficient and of its
+           term in table (by default the TermTable of the evaluator), in
+           the order in which the patterns appear in the numerator"""
+        if table is None:
+            if self.evaluator:
+                table = self.evaluator.terms
+            elif self._terms is not None:
+                table = self._terms
+            else:
+                table = TermTable()
+        if table is self._terms and self._term_indices is not None:
+            return
 
+        indices = [
+            table.add(pattern)
+            for pattern in Add.make_args(self.numerator)
+            if pattern != 0
+        ]
+        self._coefficient_indices = np.array(
+            [coefficient for coefficient, term in indices],
+            dtype=np.int32
+        )
+        self._term_indices = np.array(
+            [term for coefficient, term in indices],
+            dtype=np.int32
+        )
+        self._terms = table
+        self._pattern_values = None
+        self._percentages = None
+        self._patterns_function = None
+        self._exponents = None
+        self._top_functions = {}
+        self._reference = None
 
     def _check_control_patterns(self):
         """Checks that all control patterns are either positive or negative"""
-        all_same = False
-        poscomp = [i.value > 0 for i in self.control_patterns]
-        negcomp = [i.value < 0 for i in self.control_patterns]
-        if all(poscomp):
-            all_same = True
-        elif all(negcomp):
-            all_same = True
-        return all_same
-
-
-class CPattern(CCBase):
-    """docstring for CPattern"""
-    
-    def __init__(self, mod, name, expression, denominator, parent):
-        super(CPattern, self).__init__(mod, name, expression)
-        self.numerator = expression
-        self.denominator = denominator.expression
-        self.expression = self.numerator / denominator.expression
-        self.denominator_object = denominator
+        values = self._pattern_values_at(self.model_values.generation)
+        return bool(np.all(values > 0) or np.all(values < 0))
+
+
+class CPattern(object):
+    """A control pattern: a view of the pattern with number index + 1 of
+    the control coefficient parent. All data is kept by the parent (see
+    CCoef._split_patterns), so these objects are small and can be
+    created whenever they are needed."""
+
+    __slots__ = ('parent', 'index')
+
+    def __init__(self, parent, index):
         self.parent = parent
-        
-        self._latex_numerator = None
-        self._latex_expression_full = None
-        self._latex_expression =  None
-        self._latex_name = None
-        self._percentage = None
+        self.index = index
+
+    def __eq__(self, other):
+        return (isinstance(other, CPattern) and
+                self.parent is other.parent and self.index == other.index)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.parent), self.index))
+
+    @property
+    def name(self):
+        return 'CP' + str(1 + self.index)
+
+    @property
+    def mod(self):
+        return self.parent.mod
+
+    @property
+    def symbols(self):
+        return self.parent.symbols
+
+    @property
+    def numerator(self):
+        parent = self.parent
+        table = parent._terms
+        return (
+            table.coefficients[parent._coefficient_indices[self.index]] *
+            table.terms[parent._term_indices[self.index]]
+        )
+
+    @property
+    def denominator(self):
+        return self.parent.denominator
+
+    @property
+    def denominator_object(self):
+        return self.parent.denominator_object
+
+    @property
+    def expression(self):
+        return self.numerator / self.denominator
+
+    @property
+    def value(self):
+        parent = self.parent
+        generation = parent.model_values.generation
+        return parent._pattern_values_at(generation)[self.index]
+
+    @property
+    def percentage(self):
+        """The percentage of the parent control coefficient contributed
+        by this pattern, calculated once per model state"""
+        return self.parent.percentages[self.index]
 
     @property
     def latex_numerator(self):
-        if not self._latex_numerator:
-            self._latex_numerator = PYCtools.expression_to_latex(
-            self.numerator
-            )
-        return self._latex_numerator
+        return PYCtools.expression_to_latex(self.numerator)
 
     @property
     def latex_expression_full(self):
-        if not self._latex_expression_full:
-            full_expr = '\\frac{' + self.latex_numerator + '}{' \
-                         + self.denominator_object.latex_expression
-            self._latex_expression_full = full_expr
-        return self._latex_expression_full
+        return '\\frac{' + self.latex_numerator + '}{' \
+               + self.denominator_object.latex_expression
 
     @property
     def latex_expression(self):
-        if not self._latex_expression:
-            self._latex_expression =  self.latex_numerator + '/ \\,\\Sigma'
-        return self._latex_expression
-        
+        return self.latex_numerator + '/ \\,\\Sigma'
+
     @property
     def latex_name(self):
-        if not self._latex_name:
-            self._latex_name = PYCtools.expression_to_latex(
-            self.name
+        return PYCtools.expression_to_latex(self.name)
+
+
+class TermTable(object):
+    """The distinct terms (products of symbols) and coefficients of the
+    control patterns of a model. A pattern is stored as the index of its
+    coefficient and of its term, so a term that appears in several
+    patterns (of the same or of other control coefficients) is only
+    stored and evaluated once."""
+
+    def __init__(self):
+        super(TermTable, self).__init__()
+        self.terms = []
+        self.coefficients = []
+        self._term_index = {}
+        self._coefficient_index = {}
+        self._coefficient_values = None
+
+    def add(self, pattern):
+        """Adds the pattern (a term of a numerator) and returns the
+        tuple (coefficient index, term index)"""
+        coefficient, term = pattern.as_coeff_Mul()
+        return (
+            TermTable._intern(coefficient, self.coefficients,
+                              self._coefficient_index),
+            TermTable._intern(term, self.terms, self._term_index)
+        )
+
+    def coefficient_values(self):
+        """The coefficients as an array of floats"""
+        values = self._coefficient_values
+        if values is None or len(values) != len(self.coefficients):
+            values = np.array(
+                [float(c) for c in self.coefficients],
+                dtype=np.float
             )
-        return self._latex_name
+            self._coefficient_values = values
+        return values
+
+    @staticmethod
+    def _intern(expression, expressions, index):
+        position = index.get(expression)
+        if position is None:
+            position = len(expressions)
+            expressions.append(expression)
+            index[expression] = position
+        return position
+
+
+class CCEvaluator(object):
+    """Evaluates the common denominator and the control patterns of all
+    control coefficients of a model in one pass.
+
+    All expressions are passed through common subexpression elimination
+    together and compiled into a single function of the argument vector,
+    so products of elasticities shared by several patterns (and the
+    common denominator) are only calculated once. The patterns of all
+    control coefficients are stored in the shared TermTable terms, so
+    every distinct term is evaluated once as well. The result of the
+    last evaluation is kept, so that the control coefficients of the
+    same model state share a single evaluation."""
+
+    def __init__(self, symbols, denominator, ccs):
+        super(CCEvaluator, self).__init__()
+        self.symbols = tuple(symbols)
+        self.denominator = denominator
+        self.ccs = ccs
+        self.terms = TermTable()
+
+        self._function = None
+        # the Python source of _function, see _compile
+        self._source = None
+        self._patterns = None
+        self._args = None
+        self._values = None
+
+    def __getstate__(self):
+        # the compiled function cannot be pickled, but it is compiled
+        # again from its source
+        state = self.__dict__.copy()
+        state['_function'] = None
+        return state
+
+    def values(self, args):
+        """Returns an array with the denominator in the first row followed
+        by the terms in self.terms for the argument values args (ordered
+        as self.symbols).
+        When each argument is an array there is a column for each value"""
+        args = np.asarray(args, dtype=np.float)
+        if self._args is None or not np.array_equal(args, self._args):
+            self._compile()
+            results = np.broadcast_arrays(*self._function(args))
+            self._values = np.array(results, dtype=np.float)
+            self._args = args
+        return self._values
+
+    def pattern_values(self, cc, args):
+        """Returns the values of the control patterns of cc (see
+        CCoef._evaluate_patterns)"""
+        values = self.values(args)
+        cc._split_patterns(self.terms)
+        return cc._combine(values[1:], values[0])
+
+    def cc_values(self, args):
+        """Returns an array with the values of the control coefficients
+        in self.ccs for the argument values args of a single model
+        state. The patterns of all control coefficients are summed in a
+        single pass"""
+        values = self.values(args)
+        owners, coefficients, terms = self._patterns
+        weights = self.terms.coefficient_values()[coefficients]
+        numerators = np.bincount(
+            owners,
+            weights=weights * values[1:][terms],
+            minlength=len(self.ccs)
+        )
+        return numerators / values[0]
+
+    def update(self):
+        """Evaluates all expressions at the current model state and sets
+        the values of the denominator, control coefficients and control
+        patterns for the current model generation"""
+        generation = self.denominator.model_values.generation
+        values = self.values(self.denominator._argument_values())
+        self.denominator._set_value(values[0], generation)
+        for cc in self.ccs:
+            # a no-op unless cc was split into a table of its own
+            cc._split_patterns(self.terms)
+            cc._set_pattern_values(
+                cc._combine(values[1:], values[0]),
+                generation
+            )
+
+    def _compile(self):
+        if self._function:
+            return
+        if self._source is None:
+            self._source = self._generate()
+
+        # rational coefficients are printed as (p/q)
+        code = compile(
+            self._source,
+            '<CCEvaluator>',
+            'exec',
+            __future__.division.compiler_flag,
+            True
+        )
+        namespace = {'numpy': np}
+        exec code in namespace
+        self._function = namespace['evaluate']
+
+    def _generate(self):
+        """Returns the source of a function evaluate(x) that returns the
+        list of the values of the denominator and of all terms in
+        self.terms for the argument values x, and sets self._patterns"""
+        for cc in self.ccs:
+            cc._split_patterns(self.terms)
+        expressions = [self.denominator.expression] + self.terms.terms
+        # (control coefficient, coefficient, term) of every pattern
+        self._patterns = (
+            np.concatenate([np.zeros(0, dtype=int)] + [
+                np.repeat(i, len(cc._term_indices))
+                for i, cc in enumerate(self.ccs)
+            ]),
+            np.concatenate([np.zeros(0, dtype=np.int32)] + [
+                cc._coefficient_indices for cc in self.ccs
+            ]),
+            np.concatenate([np.zeros(0, dtype=np.int32)] + [
+                cc._term_indices for cc in self.ccs
+            ])
+        )
+
+        arguments = dict(
+            (symbol, Symbol('_x%d' % i)) for i, symbol in enumerate(self.symbols)
+        )
+        expressions = [e.xreplace(arguments) for e in expressions]
+        replacements, reduced = cse(
+            expressions,
+            symbols=numbered_symbols('_c')
+        )
+
+        printer = NumPyPrinter()
+        lines = ['def evaluate(x):']
+        for i in range(len(self.symbols)):
+            lines.append('    _x%d = x[%d]' % (i, i))
+        for symbol, expression in replacements:
+            lines.append('    %s = %s' % (symbol, printer.doprint(expression)))
+        lines.append('    return [%s]' % ', '.join(
+            printer.doprint(expression) for expression in reduced
+        ))
+        return '\n'.join(lines)
 
-    @property
-    def percentage(self):
-        self._percentage = (self.value / self.parent.value) * 100
-        return self._percentage
\ No newline at end of file
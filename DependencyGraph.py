@@ -0,0 +1,108 @@
+import numpy as np
+
+
+# marks a value that has not been calculated (None, 0 and empty matrices
+# are valid values)
+_missing = object()
+
+
+class DependencyGraph(object):
+    """Lazily calculated values that depend on each other.
+
+    Every value is declared with add(name, function, dependencies) and
+    calculated as function(*values of dependencies) the first time it is
+    requested with graph[name]. The result is kept until one of the
+    values it depends on (directly or indirectly) changes.
+
+    Values calculated from something outside of the graph (e.g. from the
+    arrays of a model) are declared with volatile=True. refresh()
+    recalculates the volatile values that are known and, for each one
+    that changed, forgets the values downstream of it. Values that did
+    not change leave their dependents alone, so a change of a single
+    input only causes the values that depend on it to be recalculated.
+    """
+
+    def __init__(self):
+        super(DependencyGraph, self).__init__()
+        # name: (function, dependencies, volatile) in the order added
+        self._nodes = {}
+        self._order = []
+        # name: list of the names that depend on it directly
+        self._dependents = {}
+        self._values = {}
+
+    def add(self, name, function, dependencies=(), volatile=False):
+        """Declares the value name. All dependencies have to be declared
+        before"""
+        for each in dependencies:
+            if each not in self._nodes:
+                raise KeyError('unknown dependency ' + each + ' of ' + name)
+        if name in self._nodes:
+            raise KeyError(name + ' is already declared')
+        self._nodes[name] = (function, tuple(dependencies), volatile)
+        self._order.append(name)
+        self._dependents[name] = []
+        for each in dependencies:
+            self._dependents[each].append(name)
+
+    def __getitem__(self, name):
+        value = self._values.get(name, _missing)
+        if value is _missing:
+            value = self._calculate(name)
+            self._values[name] = value
+        return value
+
+    def __contains__(self, name):
+        """True if the value of name is known"""
+        return name in self._values
+
+    def invalidate(self, name):
+        """Forgets the value of name and of everything that depends on
+        it"""
+        self._values.pop(name, None)
+        self._invalidate_dependents(name)
+
+    def refresh(self, names=None):
+        """
+        Recalculates the known volatile values (or the values in names)
+        and forgets the values that depend on the ones that changed.
+        Returns the list of the names that changed.
+        """
+        if names is None:
+            names = [name for name in self._order if self._nodes[name][2]]
+        else:
+            names = [name for name in self._order if name in names]
+
+        changed = []
+        # in the order of declaration, so that a value is only
+        # recalculated after the values it depends on
+        for name in names:
+            old = self._values.get(name, _missing)
+            if old is _missing:
+                continue
+            new = self._calculate(name)
+            if not DependencyGraph._same(old, new):
+                self._values[name] = new
+                self._invalidate_dependents(name)
+                changed.append(name)
+        return changed
+
+    def _calculate(self, name):
+        function, dependencies, volatile = self._nodes[name]
+        return function(*[self[each] for each in dependencies])
+
+    def _invalidate_dependents(self, name):
+        for each in self._dependents[name]:
+            if each in self._values:
+                del self._values[each]
+                self._invalidate_dependents(each)
+
+    @staticmethod
+    def _same(a, b):
+        if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+            return (isinstance(a, np.ndarray) and
+                    isinstance(b, np.ndarray) and
+                    a.shape == b.shape and np.array_equal(a, b))
+        if type(a) != type(b):
+            return False
+        return bool(a == b)
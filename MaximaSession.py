@@ -0,0 +1,253 @@
+import re
+import subprocess
+import threading
+import atexit
+import time
+from os import getpid
+from Queue import Queue, Empty
+
+
+# seconds a single factor() may take by default. None waits forever.
+DEFAULT_TIMEOUT = 600
+
+
+class MaximaError(Exception):
+    """Raised when maxima fails to return a result for an expression"""
+    pass
+
+
+class MaximaTimeoutError(MaximaError):
+    """Raised when maxima takes longer than the session timeout"""
+    pass
+
+
+class MaximaInputError(MaximaError):
+    """Raised when maxima rejects an expression (e.g. a syntax error) or
+    stops to ask a question instead of returning a result"""
+    pass
+
+
+class MaximaSession(object):
+    """A single long-lived maxima process.
+
+    Expressions are written to the stdin of the process and the factored
+    results are read back from its stdout. This avoids starting a new
+    maxima process (and writing in.txt/out.txt) for every expression.
+
+    The process is started on first use and is restarted automatically
+    if it has died or if it was started in a different (parent) process.
+
+    Errors while factoring are caught by maxima itself, but an expression
+    that cannot be parsed never produces a result. Output that shows
+    this (a syntax error, an input prompt or a question) is detected
+    and raises MaximaInputError at once instead of waiting for timeout.
+    """
+
+    _begin = '__symca_begin__'
+    _end = '__symca_end__'
+    _fail = '__symca_error__'
+    # output after which maxima does not run the rest of the statement
+    _stalled = re.compile(
+        r'incorrect syntax|^\(%i\d+\)|^dbm:\d+>|^MAXIMA>|'
+        r'(positive|negative|zero|nonzero)\?$'
+    )
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, command='maxima'):
+        super(MaximaSession, self).__init__()
+        self.timeout = timeout
+        self.command = command
+
+        self._process = None
+        self._lines = None
+        self._pid = None
+
+    @property
+    def is_alive(self):
+        return (self._process is not None and
+                self._pid == getpid() and
+                self._process.poll() is None)
+
+    def start(self):
+        """Starts the maxima process and the thread reading its output"""
+        self._process = subprocess.Popen(
+            [self.command, '--very-quiet'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True
+        )
+        self._pid = getpid()
+        self._lines = Queue()
+
+        def read_output(stream, lines):
+            for line in iter(stream.readline, ''):
+                lines.put(line)
+            lines.put(None)
+
+        reader = threading.Thread(
+            target=read_output,
+            args=(self._process.stdout, self._lines)
+        )
+        reader.daemon = True
+        reader.start()
+
+        self._write('display2d:false$ linel:1000000$\n')
+
+    def close(self):
+        """Asks maxima to quit and kills the process if it does not"""
+        if not self.is_alive:
+            self._process = None
+            return
+        try:
+            self._write('quit();\n')
+            self._process.stdin.close()
+        except (IOError, OSError):
+            pass
+        for i in range(20):
+            if self._process.poll() is not None:
+                break
+            time.sleep(0.05)
+        else:
+            self.kill()
+        self._process = None
+
+    def kill(self):
+        if self._process is not None and self._pid == getpid():
+            try:
+                self._process.kill()
+                self._process.wait()
+            except OSError:
+                pass
+        self._process = None
+
+    def factor(self, expression):
+        """Returns factor(expression) as a string in maxima syntax.
+
+        Raises MaximaTimeoutError (and kills the process) if no result
+        arrives within self.timeout seconds, MaximaInputError (and kills
+        the process) if maxima rejects the expression and MaximaError if
+        maxima could not factor the expression or died while doing so."""
+        if not self.is_alive:
+            self.start()
+
+        statement = (
+            '__symca_r:errcatch(string(factor(%s)))$ '
+            'print("%s")$ '
+            'if __symca_r = [] then print("%s") '
+            'else print(first(__symca_r))$ '
+            'print("%s")$\n'
+        ) % (expression, self._begin, self._fail, self._end)
+        try:
+            self._write(statement)
+        except (IOError, OSError):
+            self.kill()
+            raise MaximaError('maxima process exited unexpectedly')
+
+        if self.timeout:
+            deadline = time.time() + self.timeout
+        else:
+            deadline = None
+
+        result = []
+        started = False
+        while True:
+            line = self._read_line(deadline)
+            line = line.strip()
+            if not started:
+                started = line == self._begin
+                if not started and self._stalled.search(line):
+                    # the rest of the output of the statement may still
+                    # arrive, so a new process is started next time
+                    self.kill()
+                    raise MaximaInputError(
+                        'maxima rejected ' + expression + ': ' + line
+                    )
+            elif line == self._end:
+                break
+            else:
+                result.append(line)
+
+        result = ''.join(result)
+        if result == self._fail:
+            raise MaximaError('maxima could not factor ' + expression)
+        return result
+
+    def _write(self, text):
+        self._process.stdin.write(text)
+        self._process.stdin.flush()
+
+    def _read_line(self, deadline):
+        try:
+            if deadline is None:
+                line = self._lines.get()
+            else:
+                line = self._lines.get(
+                    timeout=max(deadline - time.time(), 0)
+                )
+        except Empty:
+            self.kill()
+            raise MaximaTimeoutError(
+                'maxima did not respond within %s seconds' % self.timeout
+            )
+        if line is None:
+            self.kill()
+            raise MaximaError('maxima process exited unexpectedly')
+        return line
+
+
+class MaximaPool(object):
+    """A small pool of MaximaSession objects.
+
+    factor() takes an idle session from the pool, so the pool can be
+    used from several threads at once. A session that crashed is
+    restarted and the expression retried once. All sessions are closed
+    when the interpreter exits."""
+
+    def __init__(self, size=1, timeout=DEFAULT_TIMEOUT, command='maxima'):
+        super(MaximaPool, self).__init__()
+        self.size = size
+        self.timeout = timeout
+        self.command = command
+
+        self._sessions = []
+        self._idle = Queue()
+        self._lock = threading.Lock()
+        self._pid = getpid()
+
+        atexit.register(self.close)
+
+    def factor(self, expression):
+        session = self._acquire()
+        try:
+            try:
+                return session.factor(expression)
+            except (MaximaTimeoutError, MaximaInputError):
+                raise
+            except MaximaError:
+                if session.is_alive:
+                    raise
+                # maxima crashed, try again on a fresh process
+                return session.factor(expression)
+        finally:
+            self._idle.put(session)
+
+    def close(self):
+        """Shuts down every session in the pool"""
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != getpid():
+                # we are in a forked child, the sessions belong to the parent
+                self._sessions = []
+                self._idle = Queue()
+                self._pid = getpid()
+            if self._idle.empty() and len(self._sessions) < self.size:
+                session = MaximaSession(self.timeout, self.command)
+                self._sessions.append(session)
+                return session
+        session = self._idle.get()
+        session.timeout = self.timeout
+        return session
@@ -0,0 +1,195 @@
+import numpy as np
+
+
+class ModelValues(object):
+    """Reads the values of the symbols of the symca expressions from the
+    value arrays of a model.
+
+    The elasticities (ec<reaction>_<species>), fluxes (J_<reaction>) and
+    species of a model are kept in the arrays elas_var (rows ordered as
+    elas_var_row, columns as elas_var_col), state_flux (ordered as
+    reactions) and state_species (ordered as species). The position of
+    every such symbol in these arrays is looked up once, after which the
+    values of an ordered tuple of symbols are gathered with a single
+    index operation instead of an attribute lookup per symbol. Symbols
+    that are not in the arrays (or all symbols, if the model does not
+    have them) are read with getattr.
+
+    The map is built on first use, as the arrays of a PySCeS model only
+    exist after the elasticities have been calculated. All CC objects of
+    a model share one ModelValues object (see Symca.model_values).
+
+    generation numbers the states of the model, so values calculated
+    for the same generation can be reused. It changes whenever the model
+    replaces one of the arrays by a new one, as PySCeS does every time
+    it calculates the steady state and the elasticities. Only the
+    identity of the arrays is checked, so it costs the same for any
+    model size, but changes made to the arrays in place are not seen.
+    As the CC expressions only depend on these values a new parameter
+    value only changes the generation once the steady state has been
+    calculated. Models without the arrays (or that change them in
+    place) only get a new generation when changed() is called.
+    """
+
+    def __init__(self, mod):
+        super(ModelValues, self).__init__()
+        self.mod = mod
+        # {symbol name: position in the array returned by _flat()}
+        self._index = None
+        # {symbols: (indices, [(position, name), ...] read with getattr)}
+        self._plans = {}
+        # ({reaction: row}, {species: column}) of elas_var
+        self._axes_map = None
+        self._generation = 0
+        # the arrays of the model at the current generation
+        self._state = None
+
+    @property
+    def generation(self):
+        """The number of the current model state (see class
+        docstring)"""
+        state = self._arrays()
+        if state is not None:
+            if self._state is None:
+                self._state = state
+            elif any(a is not b for a, b in zip(state, self._state)):
+                self._state = state
+                self._generation += 1
+        return self._generation
+
+    def changed(self):
+        """Starts a new generation, e.g. after a model without value
+        arrays changed"""
+        self._generation += 1
+        self._state = None
+
+    def values(self, symbols):
+        """Returns an array with the current model values of symbols (a
+        tuple of symbols or names)"""
+        plan = self._plans.get(symbols)
+        if plan is None:
+            plan = self._plan(symbols)
+        return self._read(plan)
+
+    def elasticities(self, reactions, species):
+        """Returns an array (reactions x species) with the current values
+        of the elasticities of reactions towards species (both lists of
+        names). If the model has elas_var they are taken from it with a
+        single index operation, without building the name of every
+        elasticity."""
+        axes = self._axes()
+        if axes is not None:
+            rows, columns = axes
+            try:
+                row_indices = [rows[reaction] for reaction in reactions]
+                column_indices = [columns[each] for each in species]
+            except KeyError:
+                pass
+            else:
+                elas = np.asarray(self.mod.elas_var, dtype=np.float)
+                return elas[np.ix_(row_indices, column_indices)]
+
+        symbols = tuple(
+            'ec' + reaction + '_' + each
+            for reaction in reactions
+            for each in species
+        )
+        # only used once per model, so the plan is not kept
+        values = self._read(self._plan(symbols, keep=False))
+        return values.reshape(len(reactions), len(species))
+
+    def reset(self):
+        """Forgets the map, e.g. after the model structure changed"""
+        self._index = None
+        self._axes_map = None
+        self._plans = {}
+        self.changed()
+
+    def _arrays(self):
+        """The value arrays of the model or None if it does not have
+        them (yet)"""
+        mod = self.mod
+        try:
+            return mod.elas_var, mod.state_flux, mod.state_species
+        except AttributeError:
+            return None
+
+    def _read(self, plan):
+        indices, missing = plan
+        if len(missing) == len(indices):
+            values = np.empty(len(indices))
+        else:
+            values = self._flat()[indices]
+        for position, name in missing:
+            values[position] = getattr(self.mod, name)
+        return values
+
+    def _axes(self):
+        """The row and column maps of elas_var or None if the model does
+        not have it (yet)"""
+        if self._axes_map is None:
+            try:
+                rows = self.mod.elas_var_row
+                columns = self.mod.elas_var_col
+            except AttributeError:
+                return None
+            self._axes_map = (
+                dict((name, i) for i, name in enumerate(rows)),
+                dict((name, j) for j, name in enumerate(columns)),
+            )
+        return self._axes_map
+
+    def _flat(self):
+        mod = self.mod
+        return np.concatenate((
+            np.asarray(mod.elas_var, dtype=np.float).ravel(),
+            np.asarray(mod.state_flux, dtype=np.float),
+            np.asarray(mod.state_species, dtype=np.float),
+        ))
+
+    def _build(self):
+        """Builds the map or returns False if the model does not have the
+        value arrays (yet)"""
+        mod = self.mod
+        try:
+            rows = list(mod.elas_var_row)
+            columns = list(mod.elas_var_col)
+            reactions = list(mod.reactions)
+            species = list(mod.species)
+        except AttributeError:
+            return False
+
+        index = {}
+        for i, reaction in enumerate(rows):
+            for j, each in enumerate(columns):
+                index['ec' + reaction + '_' + each] = i * len(columns) + j
+        offset = len(rows) * len(columns)
+        for i, reaction in enumerate(reactions):
+            index['J_' + reaction] = offset + i
+        offset += len(reactions)
+        for j, each in enumerate(species):
+            index[each] = offset + j
+        self._index = index
+        return True
+
+    def _plan(self, symbols, keep=True):
+        if self._index is None and not self._build():
+            index = {}
+        else:
+            index = self._index
+
+        names = [str(symbol) for symbol in symbols]
+        indices = np.zeros(len(names), dtype=int)
+        missing = []
+        for position, name in enumerate(names):
+            if name in index:
+                indices[position] = index[name]
+            else:
+                missing.append((position, name))
+
+        plan = (indices, missing)
+        # a map built without the arrays is not kept, so that they are
+        # used once the model has them
+        if keep and self._index is not None:
+            self._plans[symbols] = plan
+        return plan
@@ -0,0 +1,275 @@
+from fractions import Fraction
+from tempfile import mkdtemp
+import numpy as np
+
+
+class NumpyModel(object):
+    """An in-memory stand-in for a PySCeS model.
+
+    Symca only needs a small part of a PySCeS model. A model object has
+    to provide:
+
+    species, reactions          -- tuples with the names of the variable
+                                   species and of the reactions
+    nmatrix                     -- the stoichiometric matrix (species x
+                                   reactions) as an ndarray
+    kmatrix, kmatrix_row,       -- the kernel matrix K = [I; K0] with its
+    kmatrix_col                    row order (indices into reactions) and
+                                   independent fluxes (columns)
+    lmatrix, lmatrix_row,       -- the link matrix L = [I; L0] with its
+    lmatrix_col                    row order (indices into species) and
+                                   independent species (columns)
+    ModelOutput, ModelFile      -- the output directory and model file
+                                   name used for the working directories
+    doMca(), SetQuiet(),        -- update the steady state values below
+    SetLoud()
+    ec<reaction>_<species>,     -- the scaled elasticities, steady state
+    J_<reaction>, <species>        fluxes and species concentrations
+    cc_all, cc_all_row,         -- the scaled control coefficients (only
+    cc_all_col                     used to check the symca results): a
+                                   row for every flux followed by one
+                                   for every species, in the order of
+                                   the names in cc_all_row, and a column
+                                   for every reaction in cc_all_col
+
+    This class implements that protocol with NumPy only. The structural
+    matrices are calculated (exactly) from a list of reactions, while the
+    elasticities, fluxes and concentrations are simply given. Their
+    values are kept in the arrays elas_var (reactions x species),
+    state_flux and state_species, and the ec..., J_... and species
+    attributes read from these arrays. Setting one of them replaces its
+    array by an updated copy, just as PySCeS replaces the arrays when it
+    calculates a new steady state, so that ModelValues sees the change.
+
+    doMca() does not solve anything. If an update function is given it
+    is called as update(model) so that it can set new values depending
+    on the (otherwise unused) parameters of the model. The control
+    coefficients are then calculated numerically from the elasticities
+    (see calculate_cc).
+    """
+
+    def __init__(self, reactions, fixed=(), elasticities=None, fluxes=None,
+                 concentrations=None, update=None, name='numpy_model',
+                 directory=None):
+        """
+        reactions      -- a list of (name, substrates, products) where
+                          substrates and products are lists of species
+                          names (repeat a name for stoichiometries > 1)
+        fixed          -- names of fixed (external) species
+        elasticities   -- a dictionary {'ec<reaction>_<species>': value}.
+                          By default substrates have an elasticity of 1
+                          and products an elasticity of -0.5; the
+                          elasticities of all other pairs are 0
+        fluxes         -- a dictionary {reaction: value} of the
+                          independent fluxes (1 by default); dependent
+                          fluxes follow from the kernel matrix
+        concentrations -- a dictionary {species: value} (1 by default)
+        update         -- called by doMca() as update(model)
+        """
+        object.__setattr__(self, '_names', {})
+        super(NumpyModel, self).__init__()
+
+        self.ModelFile = name + '.psc'
+        if directory is None:
+            directory = mkdtemp(prefix='symca_')
+        self.ModelOutput = directory
+        self.update = update
+
+        species = []
+        for reaction, substrates, products in reactions:
+            for each in list(substrates) + list(products):
+                if each not in species and each not in fixed:
+                    species.append(each)
+        self.species = tuple(species)
+        self.reactions = tuple(reaction[0] for reaction in reactions)
+        self.fixed_species = tuple(fixed)
+
+        nmatrix = np.zeros((len(species), len(reactions)))
+        for j, (reaction, substrates, products) in enumerate(reactions):
+            for each in substrates:
+                if each in species:
+                    nmatrix[species.index(each), j] -= 1
+            for each in products:
+                if each in species:
+                    nmatrix[species.index(each), j] += 1
+        self.nmatrix = nmatrix
+
+        self._set_structure()
+
+        self.elas_var_row = self.reactions
+        self.elas_var_col = self.species
+        self.elas_var = np.zeros((len(self.reactions), len(self.species)))
+        for j, (reaction, substrates, products) in enumerate(reactions):
+            for each in substrates:
+                if each in species:
+                    self.elas_var[j, species.index(each)] = 1.0
+            for each in products:
+                if each in species:
+                    self.elas_var[j, species.index(each)] = -0.5
+
+        self.state_species = np.ones(len(self.species))
+        self.state_flux = np.ones(len(self.reactions))
+
+        names = self._names
+        for i, reaction in enumerate(self.reactions):
+            names['J_' + reaction] = ('state_flux', i)
+            for j, each in enumerate(self.species):
+                names['ec' + reaction + '_' + each] = ('elas_var', (i, j))
+        for j, each in enumerate(self.species):
+            names[each] = ('state_species', j)
+        # cc_all has a row for every flux followed by a row for every
+        # species and a column for every reaction
+        self.cc_all_row = self.reactions + self.species
+        self.cc_all_col = self.reactions
+        for j, reaction in enumerate(self.reactions):
+            for i, each in enumerate(self.reactions):
+                names['ccJ' + each + '_' + reaction] = ('cc_all', (i, j))
+            for i, each in enumerate(self.species):
+                names['cc' + each + '_' + reaction] = (
+                    'cc_all',
+                    (len(self.reactions) + i, j)
+                )
+
+        for each, value in (concentrations or {}).items():
+            setattr(self, each, value)
+        for each, value in (elasticities or {}).items():
+            setattr(self, each, value)
+        self.set_fluxes(fluxes or {})
+        self.calculate_cc()
+
+    def __getattr__(self, name):
+        # only called for names that are not normal attributes
+        names = object.__getattribute__(self, '_names')
+        if name in names:
+            array, index = names[name]
+            return getattr(self, array)[index]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in self._names:
+            array, index = self._names[name]
+            values = getattr(self, array).copy()
+            values[index] = value
+            object.__setattr__(self, array, values)
+        else:
+            object.__setattr__(self, name, value)
+
+    def set_fluxes(self, fluxes):
+        """Sets the independent fluxes given in the dictionary fluxes
+        ({reaction: value}) and calculates the dependent fluxes from the
+        kernel matrix"""
+        state_flux = self.state_flux.copy()
+        for each, value in fluxes.items():
+            state_flux[self.reactions.index(each)] = value
+        independent = state_flux[self.kmatrix_col]
+        state_flux[self.kmatrix_row] = np.dot(self.kmatrix, independent)
+        self.state_flux = state_flux
+
+    def calculate_cc(self):
+        """
+        Calculates the scaled control coefficients (cc_all) from the
+        current elasticities, fluxes and concentrations with
+
+            [C^J; C^S] = [K 0; 0 L] [K  -elasticities L]^-1
+
+        where all matrices are scaled and the fluxes and species are
+        ordered as the rows of the K and L matrices. The control
+        coefficients are nan if the matrix is singular.
+        """
+        num_reactions = len(self.reactions)
+        krow = self.kmatrix_row
+        lrow = self.lmatrix_row
+        fluxes = self.state_flux[krow]
+        species = self.state_species[lrow]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kmatrix = (self.kmatrix / fluxes[:, None] *
+                       fluxes[:len(self.kmatrix_col)])
+            lmatrix = (self.lmatrix / species[:, None] *
+                       species[:len(self.lmatrix_col)])
+        elasticities = self.elas_var[np.ix_(krow, lrow)]
+        ematrix = np.hstack((kmatrix, -np.dot(elasticities, lmatrix)))
+
+        cc_all = np.empty((num_reactions + len(self.species), num_reactions))
+        try:
+            inverse = np.linalg.inv(ematrix)
+        except np.linalg.LinAlgError:
+            cc_all[:] = np.nan
+        else:
+            num_fluxes = kmatrix.shape[1]
+            flux_cc = np.dot(kmatrix, inverse[:num_fluxes, :])
+            species_cc = np.dot(lmatrix, inverse[num_fluxes:, :])
+            # back to the order of reactions and species
+            cc_all[np.ix_(krow, krow)] = flux_cc
+            cc_all[np.ix_(num_reactions + lrow, krow)] = species_cc
+        self.cc_all = cc_all
+
+    def doMca(self):
+        if self.update:
+            self.update(self)
+        self.calculate_cc()
+
+    def SetQuiet(self):
+        pass
+
+    def SetLoud(self):
+        pass
+
+    def _set_structure(self):
+        """Calculates the K and L matrices and their row/column orders
+        from the N matrix with exact (fraction) arithmetic"""
+        n = [[Fraction(int(e)) for e in row] for row in self.nmatrix]
+        num_species = len(self.species)
+        num_reactions = len(self.reactions)
+
+        # independent species are the pivot columns of rref(N^T);
+        # column d of rref(N^T) expresses dependent species d in them
+        transposed = [list(column) for column in zip(*n)] if n else []
+        rref, pivots = NumpyModel._rref(transposed, num_species)
+        dependent = [i for i in range(num_species) if i not in pivots]
+        self.lmatrix_col = np.array(pivots, dtype=int)
+        self.lmatrix_row = np.array(pivots + dependent, dtype=int)
+        lmatrix = np.zeros((num_species, len(pivots)))
+        lmatrix[:len(pivots), :] = np.eye(len(pivots))
+        for row, d in enumerate(dependent):
+            for k in range(len(pivots)):
+                lmatrix[len(pivots) + row, k] = float(rref[k][d])
+        self.lmatrix = lmatrix
+
+        # dependent fluxes are the pivot columns of rref(N), the other
+        # (free) columns are the independent fluxes
+        rref, pivots = NumpyModel._rref(n, num_reactions)
+        free = [j for j in range(num_reactions) if j not in pivots]
+        self.kmatrix_col = np.array(free, dtype=int)
+        self.kmatrix_row = np.array(free + pivots, dtype=int)
+        kmatrix = np.zeros((num_reactions, len(free)))
+        kmatrix[:len(free), :] = np.eye(len(free))
+        for k, p in enumerate(pivots):
+            for column, f in enumerate(free):
+                kmatrix[len(free) + k, column] = float(-rref[k][f])
+        self.kmatrix = kmatrix
+
+    @staticmethod
+    def _rref(rows, num_columns):
+        """Returns the reduced row echelon form of rows (a list of lists
+        of Fractions) and the list of pivot columns"""
+        m = [list(row) for row in rows]
+        pivots = []
+        r = 0
+        for c in range(num_columns):
+            for i in range(r, len(m)):
+                if m[i][c] != 0:
+                    break
+            else:
+                continue
+            m[r], m[i] = m[i], m[r]
+            pivot = m[r][c]
+            m[r] = [e / pivot for e in m[r]]
+            for i in range(len(m)):
+                if i != r and m[i][c] != 0:
+                    factor = m[i][c]
+                    m[i] = [a - factor * b for a, b in zip(m[i], m[r])]
+            pivots.append(c)
+            r += 1
+            if r == len(m):
+                break
+        return m, pivots
@@ -1,18 +1,52 @@
+import numpy as np
+from sympy import fraction, S
 from sympy.matrices import Matrix
 
 from PyscesToolBox import PyscesToolBox as PYCtools
 from SymcaToolBox import SymcaToolBox as SMCAtools
 from LatexOut import LatexOut
+from SymcaCache import SymcaCache
+from SymcaProfiler import SymcaProfiler
+from SymcaCheckpoint import SymcaCheckpoint
+from CCobjects import CCBase, CCoef, CCEvaluator
+from ModelValues import ModelValues
+from DependencyGraph import DependencyGraph
 
 import logging
 
 
 class Symca(object):
-    def __init__(self, mod):
+    # change this when a change to do_symca changes the results it
+    # calculates, so that results cached by earlier versions are not used
+    code_version = '1'
+
+    def __init__(self, mod, workers=1, adjugate_method='bareiss',
+                 block_decompose=True, backend='maxima',
+                 det_method='polynomial', cache=True,
+                 cache_size=256 * 2 ** 20, log_expressions=False,
+                 checkpoint=True, expression_sizes=False):
         super(Symca, self).__init__()
         
 
         self.mod = mod        
+        # number of processes used to factor the control coefficient
+        # matrix in do_symca
+        self.workers = workers
+        # 'bareiss' or 'minors', see SymcaToolBox.adjugate_matrix
+        self.adjugate_method = adjugate_method
+        # invert the ematrix per block of its block triangular form
+        self.block_decompose = block_decompose
+        # simplification backend, 'maxima', 'sympy' (no maxima needed) or
+        # one added with SymcaToolBox.register_backend
+        self.backend = backend
+        # 'polynomial' or 'bareiss', see SymcaToolBox.determinant
+        self.det_method = det_method
+        # reuse the results of an earlier do_symca on a model with the
+        # same structure, see cache_key
+        self.cache = cache
+        # store intermediate results while solving so that an
+        # interrupted run can be resumed, see SymcaCheckpoint
+        self.checkpoint = checkpoint
 
         self._main_dir = 'sympy_symca'
         self._working_dir = PYCtools.make_path(self.mod, self._main_dir)
@@ -25,191 +59,185 @@ class Symca(object):
         print self._working_dir + 'symca.log'
 
         self._latex_out = LatexOut(self)
+        # created on first use, so that there is no cache directory if
+        # the cache is not used
+        self._cache = None
+        self._cache_size = cache_size
+        # records the time, memory and expression sizes of each stage of
+        # do_symca (see SymcaProfiler). Add functions to
+        # self.profiler.hooks to receive the report of each run, which is
+        # also kept as self.profile. Full expressions are only logged if
+        # log_expressions is True and the sizes of the expressions are
+        # only recorded if expression_sizes is True.
+        self.profiler = SymcaProfiler(log_expressions, expression_sizes)
+        self.profile = None
+        # the positions of the symbols in the value arrays of the model,
+        # used by get_es_matrix and by all CC objects (see ModelValues)
+        self.model_values = ModelValues(mod)
 
         self._object_populated = False
 
-        self._nmatrix = None
-        self._species = None
-        self._num_ind_species = None
-        self._species_independent = None
-        self._species_dependent = None
-        self._fluxes = None
-        self._num_ind_fluxes = None
-        self._fluxes_independent = None
-        self._fluxes_dependent = None
-        self._kmatrix = None
-        self._lmatrix = None
-        self._subs_fluxes = None
-        self._scaled_k = None
-        self._scaled_l = None
-        self._scaled_k0 = None
-        self._scaled_l0 = None
-        self._es_matrix = None
-        self._esL = None
-        self._ematrix = None
-
+        # the matrices and vectors derived from the model. Each one is
+        # calculated once and only recalculated when something it
+        # depends on changes (see refresh)
+        self._derived = DependencyGraph()
+        self._declare_derived()
+        # (evaluator, shape, names, positions), see _cc_layout
+        self._layout = None
+        # (names, indices, missing), see _model_cc
+        self._cc_all_index = None
+
+    def _declare_derived(self):
+        mod = self.mod
+        add = self._derived.add
+
+        # read from the model, so checked by refresh
+        add('nmatrix', lambda: SMCAtools.get_nmatrix(mod), volatile=True)
+        add('num_ind_species', lambda: SMCAtools.get_num_ind_species(mod),
+            volatile=True)
+        add('species', lambda: SMCAtools.get_species_vector(mod),
+            volatile=True)
+        add('num_ind_fluxes', lambda: SMCAtools.get_num_ind_fluxes(mod),
+            volatile=True)
+        add('fluxes', lambda: SMCAtools.get_fluxes_vector(mod),
+            volatile=True)
+        add('kmatrix', lambda: Matrix(mod.kmatrix), volatile=True)
+        add('lmatrix', lambda: Matrix(mod.lmatrix), volatile=True)
+        # only changes when an elasticity becomes zero or nonzero
+        add('es_matrix',
+            lambda nmatrix, fluxes, species: SMCAtools.get_es_matrix(
+                mod,
+                nmatrix,
+                fluxes,
+                species,
+                self.model_values
+            ),
+            ('nmatrix', 'fluxes', 'species'),
+            volatile=True)
+
+        add('species_independent',
+            lambda species, num: Matrix(species[:num]),
+            ('species', 'num_ind_species'))
+        add('species_dependent',
+            lambda species, num: Matrix(species[num:]),
+            ('species', 'num_ind_species'))
+        add('fluxes_independent',
+            lambda fluxes, num: Matrix(fluxes[:num]),
+            ('fluxes', 'num_ind_fluxes'))
+        add('fluxes_dependent',
+            lambda fluxes, num: Matrix(fluxes[num:]),
+            ('fluxes', 'num_ind_fluxes'))
+        add('cc_names', SMCAtools.build_cc_matrix,
+            ('fluxes', 'fluxes_independent', 'species_independent',
+             'fluxes_dependent', 'species_dependent'))
+        add('subs_fluxes', SMCAtools.substitute_fluxes,
+            ('fluxes', 'kmatrix'))
+        add('scaled_l', SMCAtools.scale_matrix,
+            ('species', 'lmatrix', 'species_independent'))
+        add('scaled_k', SMCAtools.scale_matrix,
+            ('subs_fluxes', 'kmatrix', 'fluxes_independent'))
+        add('scaled_l0', lambda scaled_l, num: scaled_l[num:, :],
+            ('scaled_l', 'num_ind_species'))
+        add('scaled_k0', lambda scaled_k, num: scaled_k[num:, :],
+            ('scaled_k', 'num_ind_fluxes'))
+        add('esL', lambda es_matrix, scaled_l: es_matrix * scaled_l,
+            ('es_matrix', 'scaled_l'))
+        # E = [K | -esL], the control coefficients are given by
+        # [C^J; C^S] = [K 0; 0 L] E^-1
+        add('ematrix',
+            lambda scaled_k, esL: SMCAtools.simplify_matrix(
+                scaled_k.row_join(-esL)
+            ),
+            ('scaled_k', 'esL'))
+
+    def refresh(self):
+        """
+        Checks the values read from the model (its structure and which
+        elasticities are zero) and forgets the matrices derived from
+        the ones that changed, so that they are recalculated when used.
+        Called by do_symca and iter_symca after the steady state is
+        calculated. Returns the names of the values that changed.
+        """
+        changed = self._derived.refresh()
+        if set(changed) & set(['nmatrix', 'species', 'fluxes']):
+            self.model_values.reset()
+        return changed
 
     @property
     def nmatrix(self):
-        if not self._nmatrix:
-            self._nmatrix = SMCAtools.get_nmatrix(self.mod)
-
-        return self._nmatrix
+        return self._derived['nmatrix']
 
     @property
     def num_ind_species(self):
-        if not self._num_ind_species:
-            self._num_ind_species = SMCAtools.get_num_ind_species(self.mod)
-
-        return self._num_ind_species
+        return self._derived['num_ind_species']
 
     @property
     def species(self):
-        if not self._species:
-            self._species = SMCAtools.get_species_vector(self.mod)
-
-        return self._species
+        return self._derived['species']
 
     @property
     def species_independent(self):
-        if not self._species_independent:
-            self._species_independent = Matrix(
-                self.species[:self.num_ind_species]
-            )
-
-        return self._species_independent
+        return self._derived['species_independent']
 
     @property
     def species_dependent(self):
-        if not self._species_dependent:
-            self._species_dependent = Matrix(
-                self.species[self.num_ind_species:]
-            )
-
-        return self._species_dependent
+        return self._derived['species_dependent']
 
     @property
     def num_ind_fluxes(self):
-        if not self._num_ind_fluxes:
-            self._num_ind_fluxes = SMCAtools.get_num_ind_fluxes(self.mod)
-
-        return self._num_ind_fluxes
+        return self._derived['num_ind_fluxes']
 
     @property
     def fluxes(self):
-        if not self._fluxes:
-            self._fluxes = SMCAtools.get_fluxes_vector(self.mod)
-
-        return self._fluxes
+        return self._derived['fluxes']
 
     @property
     def fluxes_independent(self):
-        if not self._fluxes_independent:
-            self._fluxes_independent = Matrix(
-                self.fluxes[:self.num_ind_fluxes]
-            )
-
-        return self._fluxes_independent
+        return self._derived['fluxes_independent']
 
     @property
     def fluxes_dependent(self):
-        if not self._fluxes_dependent:
-            self._fluxes_dependent = Matrix(
-                self.fluxes[self.num_ind_fluxes:]
-            )
-
-        return self._fluxes_dependent
+        return self._derived['fluxes_dependent']
 
     @property
     def kmatrix(self):
-        if not self._kmatrix:
-            self._kmatrix = Matrix(self.mod.kmatrix)
-
-        return self._kmatrix
+        return self._derived['kmatrix']
 
     @property
     def lmatrix(self):
-        if not self._lmatrix:
-            self._lmatrix = Matrix(self.mod.lmatrix)
-
-        return self._lmatrix
+        return self._derived['lmatrix']
 
     @property
     def subs_fluxes(self):
-        if not self._subs_fluxes:
-            self._subs_fluxes = SMCAtools.substitute_fluxes(
-                self.fluxes,
-                self.kmatrix
-            )
-
-        return self._subs_fluxes
+        return self._derived['subs_fluxes']
 
     @property
     def scaled_l(self):
-        if not self._scaled_l:
-            self._scaled_l = SMCAtools.scale_matrix(
-                self.species,
-                self.lmatrix,
-                self.species_independent
-            )
-
-        return self._scaled_l
+        return self._derived['scaled_l']
 
     @property
     def scaled_k(self):
-        if not self._scaled_k:
-            self._scaled_k = SMCAtools.scale_matrix(
-                self.subs_fluxes,
-                self.kmatrix,
-                self.fluxes_independent
-            )
-        return self._scaled_k
-
+        return self._derived['scaled_k']
 
     @property
     def scaled_l0(self):
-        if not self._scaled_l0:
-            self._scaled_l0 = self.scaled_l[self.num_ind_species:, :]
-
-        return self._scaled_l0
-
+        return self._derived['scaled_l0']
 
     @property
     def scaled_k0(self):
-        if not self._scaled_k0:
-            self._scaled_k0 = self.scaled_k[self.num_ind_fluxes:, :]
-
-        return self._scaled_k0
+        return self._derived['scaled_k0']
 
     @property
     def es_matrix(self):
-        if not self._es_matrix:
-            self._es_matrix = SMCAtools.get_es_matrix(
-                self.mod,
-                self.nmatrix,
-                self.fluxes,
-                self.species
-            )
-
-        return self._es_matrix
+        return self._derived['es_matrix']
 
     @property
     def esL(self):
-        if not self._esL:
-            self._esL = self.es_matrix * self.scaled_l
-
-        return self._esL
+        return self._derived['esL']
 
     @property
     def ematrix(self):
-        if not self._ematrix:
-            self._ematrix = SMCAtools.simplify_matrix(
-                self.scaled_k.row_join(
-                    self.esL
-                )
-            )
-
-        return self._ematrix
+        return self._derived['ematrix']
 
     def path_to(self,path):
         full_path = PYCtools.make_path(self.mod, self._main_dir, path)
@@ -218,56 +246,614 @@ class Symca(object):
     def export_latex(self):
         self._latex_out.make_main()
 
-
-    def do_symca(self):
-        self.mod.doMca()
-        
-
-        CC_i_num, common_denom_expr = SMCAtools.invert(
-            self.ematrix,
-            self.path_to('temp')
+    @property
+    def generation(self):
+        """The number of the current model state. The values of the CC
+        objects are recalculated when it changes (see ModelValues)"""
+        return self.model_values.generation
+
+    def model_changed(self):
+        """Makes the CC objects recalculate their values. Only needed
+        for models that do not keep their state in value arrays or that
+        change these arrays in place (see ModelValues), other changes
+        are detected automatically"""
+        self.model_values.changed()
+
+    def gridscan(self, parameters, scan_ranges, init_return=False):
+        """
+        Performs a scan over the grid spanned by several parameters for
+        all control coefficients at once (see CCoef.gridscan).
+
+        The steady state is only calculated once per grid point for all
+        control coefficients. The grid is scanned one row along the last
+        parameter at a time and the shared CCEvaluator evaluates a row
+        for all control coefficients at once. Returns a dictionary with
+        the name of each control coefficient as key and its gridscan
+        array as value.
+        """
+        self._require_cc('gridscan')
+        shape = tuple(len(r) for r in scan_ranges)
+        results = dict(
+            (cc.name, np.empty(shape + (cc.pattern_count,)))
+            for cc in self.CC
         )
+        rows = self.CC[0]._grid_rows(parameters, scan_ranges, init_return)
+        for index, args in rows:
+            for cc in self.CC:
+                results[cc.name][index] = cc._row_percentages(args)
+        return results
+
+    def _require_cc(self, name):
+        """Raises an error if there are no control coefficients yet (or
+        a targeted do_symca did not calculate any)"""
+        if not self._object_populated or not self.CC:
+            raise RuntimeError(
+                name + ' needs the control coefficients, call do_symca first'
+            )
 
-        logging.info ('CC_i_num:')        
-        logging.info (CC_i_num)
-        logging.info ('common_denom_expr:')
-        logging.info (common_denom_expr)
 
-        cc_sol = SMCAtools.solve_dep(
-            CC_i_num,
+    def cc_matrix(self):
+        """
+        Returns an array with the values of the control coefficients at
+        the current model state, shaped like the matrix of their names
+        (see SymcaToolBox.build_cc_matrix). All control coefficients are
+        evaluated in a single pass of the shared CCEvaluator. Control
+        coefficients that were not calculated (see do_symca with
+        cc_names) are nan.
+        """
+        self._require_cc('cc_matrix')
+        evaluator = self.CC[0].evaluator
+        shape, names, positions = self._cc_layout(evaluator)
+        values = np.empty(len(names))
+        values[:] = np.nan
+        values[positions] = evaluator.cc_values(
+            self.model_values.values(evaluator.symbols)
+        )
+        return values.reshape(shape)
+
+    def check_cc(self, rtol=1e-5, atol=1e-8):
+        """
+        Compares cc_matrix() with the numeric control coefficients of
+        the model (the matrix cc_all that PySCeS calculates in doMca).
+        Returns a list of (name, symca value, model value) for every
+        control coefficient that differs by more than atol + rtol *
+        |model value|, which is empty if all of them agree. Cheap
+        enough to be used after every steady state of a scan.
+        """
+        self._require_cc('check_cc')
+        values = self.cc_matrix().ravel()
+        shape, names, positions = self._cc_layout(self.CC[0].evaluator)
+        reference = self._model_cc(names)
+
+        calculated = np.zeros(len(names), dtype=bool)
+        calculated[positions] = True
+        with np.errstate(invalid='ignore'):
+            agree = np.abs(values - reference) <= atol + rtol * np.abs(
+                reference
+            )
+        mismatches = [
+            (names[i], values[i], reference[i])
+            for i in np.flatnonzero(calculated & ~agree)
+        ]
+        if mismatches:
+            logging.warning(
+                'check_cc: %d control coefficients differ from the model: %s'
+                % (len(mismatches), ', '.join(m[0] for m in mismatches))
+            )
+        return mismatches
+
+    def _model_cc(self, names):
+        """
+        Returns an array with the values of the control coefficients
+        names (a tuple) calculated by the model. They are taken from
+        mod.cc_all, whose rows are the fluxes (the first
+        len(mod.reactions) rows) and species in the order of
+        mod.cc_all_row and whose columns are the reactions in the order
+        of mod.cc_all_col. The position of each name is looked up once.
+        Names that are not in cc_all are read with getattr.
+        """
+        mod = self.mod
+        if self._cc_all_index is None or self._cc_all_index[0] is not names:
+            rows = list(mod.cc_all_row)
+            columns = list(mod.cc_all_col)
+            num_fluxes = len(mod.reactions)
+            index = {}
+            for i, row in enumerate(rows):
+                prefix = 'ccJ' if i < num_fluxes else 'cc'
+                for j, column in enumerate(columns):
+                    index[prefix + row + '_' + column] = i * len(columns) + j
+            indices = np.array([index.get(name, 0) for name in names],
+                               dtype=int)
+            missing = [(i, name) for i, name in enumerate(names)
+                       if name not in index]
+            self._cc_all_index = (names, indices, missing)
+        indices, missing = self._cc_all_index[1:]
+
+        values = np.asarray(mod.cc_all, dtype=np.float).ravel()[indices]
+        for i, name in missing:
+            values[i] = getattr(mod, name)
+        return values
+
+    def _cc_layout(self, evaluator):
+        """Returns the shape and the (flat) names of the matrix of
+        control coefficient names and the position of each control
+        coefficient of evaluator in it"""
+        if self._layout is None or self._layout[0] is not evaluator:
+            cc_names = self._cc_names()
+            names = tuple(str(name) for name in cc_names)
+            index = dict((name, i) for i, name in enumerate(names))
+            positions = np.array(
+                [index[cc.name] for cc in evaluator.ccs],
+                dtype=int
+            )
+            self._layout = (evaluator, cc_names.shape, names, positions)
+        return self._layout[1:]
+
+    def pattern_memory(self):
+        """
+        Returns a dictionary with the memory usage of the control
+        patterns of each control coefficient (see CCoef.memory_usage)
+        and the total number of distinct terms in the term table shared
+        by all of them ('terms').
+        """
+        self._require_cc('pattern_memory')
+        usage = dict((cc.name, cc.memory_usage()) for cc in self.CC)
+        if self.CC and self.CC[0].evaluator:
+            usage['terms'] = len(self.CC[0].evaluator.terms.terms)
+        return usage
+
+    def structural_zeros(self):
+        """
+        Returns the names of the control coefficients that are zero
+        because of the structure of the model alone: the sparsity
+        pattern of the ematrix together with the K and L matrices (see
+        SymcaToolBox.control_matrix_zeros). These are not factored by
+        do_symca.
+        """
+        cc_names = self._cc_names()
+        return [str(cc_names[i]) for i in sorted(self._structural_zeros())]
+
+    def _structural_zeros(self):
+        zeros = SMCAtools.control_matrix_zeros(
+            self.ematrix,
             self.scaled_k0,
             self.scaled_l0,
-            self.num_ind_fluxes,
-            self.path_to('temp')
+            self.num_ind_fluxes
+        )
+        return zeros or set()
+
+    def options(self):
+        """
+        Returns the options that change the symbolic result of do_symca
+        as a sorted tuple of (name, value) pairs. The number of workers
+        and the caching and logging options are not included.
+        """
+        return tuple(sorted([
+            ('adjugate_method', self.adjugate_method),
+            ('backend', self.backend),
+            ('block_decompose', self.block_decompose),
+            ('det_method', self.det_method),
+        ]))
+
+    def cache_key(self):
+        """
+        Returns a hash of everything that determines the symbolic result
+        of do_symca: the species and fluxes, the reordered N, K and L
+        matrices, the pattern of nonzero elasticities, the options
+        (see options) and code_version.
+        """
+        return SymcaCache.make_key(
+            self.code_version,
+            self.options(),
+            self.species,
+            self.fluxes,
+            self.nmatrix,
+            self.kmatrix,
+            self.lmatrix,
+            self.es_matrix
         )
 
-        cc_sol, common_denom_expr = SMCAtools.fix_expressions(
-            cc_sol,
-            common_denom_expr,
+    def do_symca(self, cc_names=None):
+        """
+        Calculates the symbolic control coefficients and sets them as
+        attributes of this object (and as the list self.CC).
+
+        If cc_names (a list of names such as 'ccJR1_R2' or the symbols of
+        SymcaToolBox.build_cc_matrix) is given only these control
+        coefficients are calculated: only the rows of the adjugate
+        they need are calculated and only their numerators are
+        factored. Such partial results are taken from a cached full
+        result if there is one, but are neither cached nor checkpointed
+        themselves.
+        """
+        profiler = self.profiler
+        profiler.start()
+        try:
+            if cc_names is None:
+                cc_objects = self._do_symca(profiler)
+            else:
+                cc_objects = self._do_symca_targeted(profiler, cc_names)
+        finally:
+            self.profile = profiler.finish()
+
+        for cc in cc_objects:
+            setattr(self, cc.name, cc)
+        self.CC = cc_objects[1:]
+        self._object_populated = True
+
+    def iter_symca(self):
+        """
+        Does the same as do_symca but yields each control coefficient as
+        soon as its numerator has been factored and fixed against the
+        common denominator. The flux control coefficients come first.
+
+        Each control coefficient is set as an attribute of this object
+        and appended to self.CC before it is yielded. self.CC is only
+        complete (and shares one compiled evaluator) once the generator
+        is exhausted. Results from the cache are yielded at once.
+        """
+        profiler = self.profiler
+        profiler.start()
+        try:
+            for cc in self._iter_symca(profiler):
+                # the caller may run other profiled code before asking
+                # for the next control coefficient
+                profiler.suspend()
+                try:
+                    yield cc
+                finally:
+                    profiler.resume()
+        finally:
+            self.profile = profiler.finish()
+
+    def _lookup(self, profiler):
+        """
+        Calculates the steady state and the ematrix and returns the cache
+        key of the model with the cached result (None if there is none)
+        """
+        with profiler.stage('doMca'):
+            self.mod.doMca()
+            self.refresh()
+
+        with profiler.stage('ematrix') as stage:
+            stage.output(self.ematrix)
+
+        with profiler.stage('cache_lookup'):
+            key = self.cache_key()
+            cached = None
+            if self.cache:
+                cached = self._result_cache().get(key)
+
+        if cached:
+            logging.info('do_symca: using cached result ' + key)
+        return key, cached
+
+    def _cc_names(self):
+        return self._derived['cc_names']
+
+    def _do_symca(self, profiler):
+        key, cached = self._lookup(profiler)
+
+        if cached:
+            cc_sol, common_denom_expr = cached
+        else:
+            checkpoint = self._checkpoint(key)
+            cc_sol, common_denom_expr = self._solve(profiler, checkpoint)
+            if self.cache:
+                with profiler.stage('cache_store'):
+                    self._result_cache().put(key, (cc_sol, common_denom_expr))
+            if checkpoint:
+                checkpoint.clear()
+
+        with profiler.stage('spawn_cc_objects'):
+            cc_objects = SMCAtools.spawn_cc_objects(
+                self.mod,
+                cc_sol,
+                self._cc_names(),
+                common_denom_expr,
+                self.model_values
+            )
+
+        return cc_objects
+
+    def _do_symca_targeted(self, profiler, cc_names):
+        key, cached = self._lookup(profiler)
+
+        # names as strings or as the symbols of build_cc_matrix
+        cc_names = [str(each) for each in cc_names]
+        all_names = [str(each) for each in self._cc_names()]
+        unknown = [each for each in cc_names if each not in all_names]
+        if unknown:
+            raise ValueError(
+                'unknown control coefficients: ' + ', '.join(unknown)
+            )
+        indices = [all_names.index(each) for each in cc_names]
+
+        if cached:
+            cc_sol = Matrix([cached[0][i] for i in indices])
+            common_denom_expr = cached[1]
+        else:
+            cc_sol, common_denom_expr = self._solve_entries(
+                profiler,
+                indices
+            )
+
+        with profiler.stage('spawn_cc_objects'):
+            cc_objects = SMCAtools.spawn_cc_objects(
+                self.mod,
+                cc_sol,
+                cc_names,
+                common_denom_expr,
+                self.model_values
+            )
+
+        return cc_objects
+
+    def _solve_entries(self, profiler, indices):
+        """
+        Same as _solve, but only for the elements of the control matrix
+        with the given (flat) indices. Returns the (fixed) numerators as
+        a column matrix in the order of indices.
+        """
+        num_cols = self._cc_names().cols
+        rows = {}
+        for i in indices:
+            rows[i] = SMCAtools.dep_row(
+                i // num_cols,
+                self.scaled_k0,
+                self.scaled_l0,
+                self.num_ind_fluxes
+            )
+        needed = sorted(set(r for i in indices for r, coefficient in rows[i]))
+        position = dict((r, a) for a, r in enumerate(needed))
+
+        with profiler.stage('invert', self.ematrix) as stage:
+            common_denom_expr = SMCAtools.factor(
+                SMCAtools.determinant(self.ematrix, self.det_method),
+                self.path_to('temp'),
+                backend=self.backend
+            )
+            adjugate_rows = SMCAtools.adjugate_rows(
+                self.ematrix,
+                needed,
+                self.adjugate_method
+            )
+            stage.output(adjugate_rows, common_denom_expr)
+
+        elements = []
+        for i in indices:
+            element = S.Zero
+            for r, coefficient in rows[i]:
+                element += coefficient * adjugate_rows[position[r], i % num_cols]
+            elements.append(element)
+
+        with profiler.stage('solve_dep', elements) as stage:
+            numerators = list(SMCAtools.iter_factor(
+                elements,
+                self.path_to('temp'),
+                self.workers,
+                self.backend
+            ))
+            stage.output(numerators)
+
+        fix_denom = SMCAtools.get_fix_denom(
             self.lmatrix,
             self.species_independent,
             self.species_dependent
         )
+        cd_num, cd_denom = fraction(common_denom_expr)
+        cc_sol = Matrix([
+            SMCAtools.fix_expression(each, cd_denom, fix_denom)
+            for each in numerators
+        ])
+        return cc_sol, (cd_num / fix_denom).expand()
+
+    def _iter_symca(self, profiler):
+        key, cached = self._lookup(profiler)
+        self.CC = []
+        self._object_populated = False
 
-        cc_names = SMCAtools.build_cc_matrix(
-            self.fluxes,
-            self.fluxes_independent,
+        if cached:
+            cc_objects = SMCAtools.spawn_cc_objects(
+                self.mod,
+                cached[0],
+                self._cc_names(),
+                cached[1],
+                self.model_values
+            )
+            self.common_denominator = cc_objects[0]
+            for cc in cc_objects[1:]:
+                setattr(self, cc.name, cc)
+                self.CC.append(cc)
+                yield cc
+            self._object_populated = True
+            return
+
+        checkpoint = self._checkpoint(key)
+        CC_i_num, common_denom_expr = self._invert(profiler, checkpoint)
+
+        # the same as fix_expressions, but one element at a time
+        fix_denom = SMCAtools.get_fix_denom(
+            self.lmatrix,
             self.species_independent,
-            self.fluxes_dependent,
             self.species_dependent
         )
+        cd_num, cd_denom = fraction(common_denom_expr)
+        common_denom_expr = (cd_num / fix_denom).expand()
 
-        cc_objects = SMCAtools.spawn_cc_objects(
+        # the symbols of all control coefficients are only known at the
+        # end, so all symbols they can contain are used instead
+        symbols = SMCAtools.get_symbols(
+            self.ematrix,
+            self.scaled_k0,
+            self.scaled_l0,
+            fix_denom
+        )
+        common_denom = CCBase(
             self.mod,
-            cc_sol,
-            cc_names,
-            common_denom_expr
+            'common_denominator',
+            common_denom_expr,
+            symbols,
+            self.model_values
         )
-
-
-        
-        for cc in cc_objects:
+        self.common_denominator = common_denom
+
+        cc_names = self._cc_names()
+        numerators = self._factor_elements(CC_i_num, len(cc_names), checkpoint)
+        cc_sol = []
+        for name in cc_names:
+            with profiler.stage(str(name)) as stage:
+                numerator = SMCAtools.fix_expression(
+                    next(numerators),
+                    cd_denom,
+                    fix_denom
+                )
+                stage.output(numerator)
+            cc_sol.append(numerator)
+            cc = CCoef(self.mod, str(name), numerator, common_denom, symbols,
+                       self.model_values)
             setattr(self, cc.name, cc)
-        self.CC = cc_objects[1:]
+            self.CC.append(cc)
+            yield cc
+
+        evaluator = CCEvaluator(symbols, common_denom, self.CC)
+        for cc in self.CC:
+            cc.evaluator = evaluator
         self._object_populated = True
 
+        if self.cache:
+            with profiler.stage('cache_store'):
+                cc_sol = Matrix(cc_names.rows, cc_names.cols, cc_sol)
+                self._result_cache().put(key, (cc_sol, common_denom_expr))
+        if checkpoint:
+            checkpoint.clear()
+
+    def _result_cache(self):
+        if self._cache is None:
+            self._cache = SymcaCache(self.path_to('cache'), self._cache_size)
+        return self._cache
+
+    def _checkpoint(self, key):
+        """The checkpoint of the model with the given cache key, None if
+        checkpointing is switched off"""
+        if not self.checkpoint:
+            return None
+        return SymcaCheckpoint(
+            self.path_to('checkpoints') + key,
+            (self.code_version, self.options())
+        )
+
+    def _invert(self, profiler, checkpoint):
+        """
+        Returns the numerators of the inverted ematrix and the (factored)
+        common denominator, see SymcaToolBox.invert
+        """
+        inverted = None
+        if checkpoint:
+            inverted = checkpoint.load('invert')
+        if inverted:
+            logging.info('invert: using checkpoint')
+            return inverted
+
+        with profiler.stage('invert', self.ematrix) as stage:
+            CC_i_num, common_denom_expr = SMCAtools.invert(
+                self.ematrix,
+                self.path_to('temp'),
+                self.adjugate_method,
+                self.block_decompose,
+                self.backend,
+                self.det_method
+            )
+            stage.output(CC_i_num, common_denom_expr)
+
+        if checkpoint:
+            checkpoint.save('invert', (CC_i_num, common_denom_expr))
+        return CC_i_num, common_denom_expr
+
+    def _factor_elements(self, CC_i_num, size, checkpoint):
+        """
+        Yields the size factored elements of the control matrix (see
+        SymcaToolBox.solve_dep) in order. Structural zeros (see
+        structural_zeros) are not factored at all. Elements found in
+        checkpoint are not factored again, all others are added to it.
+        """
+        done = {}
+        if checkpoint:
+            done = checkpoint.elements()
+            if done:
+                logging.info(
+                    'solve_dep: %d of %d elements from checkpoint'
+                    % (len(done), size)
+                )
+
+        zeros = self._structural_zeros()
+        logging.info(
+            'solve_dep: %d of %d elements are structurally zero'
+            % (len(zeros), size)
+        )
+        self.profiler.count('structural_zeros', len(zeros))
+        skip = zeros.union(done)
+
+        elements = SMCAtools.iter_dep(
+            CC_i_num,
+            self.scaled_k0,
+            self.scaled_l0,
+            self.num_ind_fluxes
+        )
+        factored = SMCAtools.iter_factor(
+            (e for i, e in enumerate(elements) if i not in skip),
+            self.path_to('temp'),
+            self.workers,
+            self.backend
+        )
+        try:
+            for i in range(size):
+                if i in done:
+                    yield done[i]
+                elif i in zeros:
+                    yield S.Zero
+                else:
+                    element = next(factored)
+                    if checkpoint:
+                        checkpoint.add_element(i, element)
+                    yield element
+        finally:
+            factored.close()
+            if checkpoint:
+                checkpoint.close()
+
+    def _solve(self, profiler, checkpoint=None):
+        """
+        Inverts the ematrix and returns the (fixed) numerators of all
+        control coefficients together with their common denominator
+        """
+        CC_i_num, common_denom_expr = self._invert(profiler, checkpoint)
+
+        with profiler.stage('solve_dep', CC_i_num) as stage:
+            cc_names = self._cc_names()
+            print 'Simplifying matrix with ' + str(len(cc_names)) + ' elements'
+            cc_sol = []
+            elements = self._factor_elements(
+                CC_i_num,
+                len(cc_names),
+                checkpoint
+            )
+            for i, element in enumerate(elements):
+                SMCAtools._progress(i)
+                cc_sol.append(element)
+            print
+            cc_sol = Matrix(cc_names.rows, cc_names.cols, cc_sol)
+            stage.output(cc_sol)
+
+        with profiler.stage('fix_expressions') as stage:
+            cc_sol, common_denom_expr = SMCAtools.fix_expressions(
+                cc_sol,
+                common_denom_expr,
+                self.lmatrix,
+                self.species_independent,
+                self.species_dependent
+            )
+            stage.output(cc_sol, common_denom_expr)
+
+        return cc_sol, common_denom_expr
+
@@ -0,0 +1,430 @@
+import json
+import platform
+import subprocess
+import traceback
+from os import path, devnull
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import strftime
+from multiprocessing import Process, Pipe
+from sympy import __version__ as sympy_version
+from SymcaToolBox import SymcaToolBox as SMCAtools
+from NumpyModel import NumpyModel
+from SymcaProfiler import SymcaProfiler
+
+
+def _measure_child(connection, function, args):
+    try:
+        start = SymcaProfiler.start_measurement()
+        result = function(*args)
+        measurement = SymcaProfiler.stop_measurement(start)
+        connection.send(('done', (measurement, result)))
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+class MeasurementError(Exception):
+    """Raised when a function measured in its own process fails. The
+    message is the traceback of the failure in that process or, if the
+    process died, its exit code"""
+    pass
+
+
+class SymcaBenchmark(object):
+    """Functions used to measure the time and memory used by the steps
+    of the symca calculations."""
+
+    @staticmethod
+    def measure(function, *args):
+        """
+        Calls function(*args) in a separate process and returns a tuple
+        (measurement, result).
+
+        measurement is a dictionary with the wall time ('time') and CPU
+        time ('cpu_time') in seconds, the peak memory of the process
+        ('peak_memory') and the increase in peak memory caused by the
+        call ('memory_increase'), both in bytes. Running the call in its
+        own process keeps the peak memory of earlier calls out of the
+        measurement.
+
+        Raises MeasurementError if the call raises an exception or the
+        process dies.
+        """
+        parent_end, child_end = Pipe(duplex=False)
+        child = Process(
+            target=_measure_child,
+            args=(child_end, function, args)
+        )
+        child.start()
+        # otherwise recv() waits for this end to be closed as well when
+        # the process dies without sending anything
+        child_end.close()
+        try:
+            status, value = parent_end.recv()
+        except EOFError:
+            status, value = 'error', None
+        finally:
+            parent_end.close()
+        child.join()
+
+        if status != 'done':
+            if value is None:
+                value = 'the process exited with code %s' % child.exitcode
+            raise MeasurementError(value)
+        return value
+
+    @staticmethod
+    def compare_determinants(matrix, methods=('bareiss', 'polynomial')):
+        """
+        Calculates the determinant of matrix (e.g. Symca.ematrix) with
+        each method of SymcaToolBox.determinant and returns a dictionary
+        with the measurement (see measure) of each method. Also checks
+        that all methods give the same determinant.
+        """
+        measurements = {}
+        results = []
+        for method in methods:
+            measurement, det = SymcaBenchmark.measure(
+                SMCAtools.determinant,
+                matrix,
+                method
+            )
+            measurements[method] = measurement
+            results.append(det)
+
+        for det in results[1:]:
+            difference = SMCAtools.factor(
+                det - results[0],
+                None,
+                backend='sympy'
+            )
+            if difference != 0:
+                raise AssertionError(
+                    'determinant methods do not give the same result'
+                )
+        return measurements
+
+    # the synthetic network families generated by network()
+    networks = ('linear', 'branched', 'cycle', 'moiety')
+
+    @staticmethod
+    def network(kind, size):
+        """
+        Returns a synthetic reaction network of the family kind (one of
+        SymcaBenchmark.networks) that grows with size (at least 2):
+
+        linear   -- X0 -> S1 -> ... -> S(size-1) -> X1
+        branched -- X0 -> S1 after which S1 feeds two chains ending in
+                    X1 and X2
+        cycle    -- X0 -> S1 -> ... -> S(size) -> S1, with an outflow
+                    from S(size) to X1
+        moiety   -- a linear chain in which every step converts A into
+                    AP, with AP -> A regenerating the moiety (A + AP
+                    is conserved)
+
+        The network is returned as a tuple (reactions, fixed) where
+        reactions is a list of (name, substrates, products) and
+        substrates and products are lists of species names. fixed is
+        the list of fixed (external) species.
+        """
+        reactions = []
+
+        def chain(names):
+            for substrate, product in zip(names[:-1], names[1:]):
+                name = 'R' + str(len(reactions) + 1)
+                reactions.append((name, [substrate], [product]))
+
+        if kind == 'linear':
+            chain(['X0'] + ['S%d' % i for i in range(1, size)] + ['X1'])
+            fixed = ['X0', 'X1']
+        elif kind == 'branched':
+            first = (size - 1) // 2
+            second = size - 1 - first
+            chain(['X0', 'S1'])
+            chain(['S1'] + ['SA%d' % i for i in range(1, first)] + ['X1'])
+            chain(['S1'] + ['SB%d' % i for i in range(1, second)] + ['X2'])
+            fixed = ['X0', 'X1', 'X2']
+        elif kind == 'cycle':
+            species = ['S%d' % i for i in range(1, size + 1)]
+            chain(['X0'] + species + ['S1'])
+            chain([species[-1], 'X1'])
+            fixed = ['X0', 'X1']
+        elif kind == 'moiety':
+            names = ['X0'] + ['S%d' % i for i in range(1, size)] + ['X1']
+            for substrate, product in zip(names[:-1], names[1:]):
+                name = 'R' + str(len(reactions) + 1)
+                reactions.append((name, [substrate, 'A'], [product, 'AP']))
+            chain(['AP', 'A'])
+            fixed = ['X0', 'X1']
+        else:
+            raise ValueError(
+                '`kind` must be one of ' + ', '.join(SymcaBenchmark.networks)
+            )
+        return reactions, fixed
+
+    @staticmethod
+    def write_psc(file_name, reactions, fixed):
+        """
+        Writes the network (see network) to a PySCeS input file with
+        reversible mass action kinetics.
+        """
+        species = []
+        for name, substrates, products in reactions:
+            for each in substrates + products:
+                if each not in species and each not in fixed:
+                    species.append(each)
+
+        lines = ['FIX: ' + ' '.join(fixed), '']
+        parameters = []
+        for name, substrates, products in reactions:
+            forward = 'k' + name
+            backward = 'k' + name + 'r'
+            parameters += [forward, backward]
+            lines += [
+                name + ':',
+                '    ' + ' + '.join(substrates) + ' = ' + ' + '.join(products),
+                '    ' + '*'.join([forward] + substrates) + ' - ' +
+                '*'.join([backward] + products),
+                ''
+            ]
+
+        lines.append('# InitPar')
+        for i, each in enumerate(fixed):
+            lines.append('%s = %s' % (each, 10.0 if i == 0 else 1.0))
+        for each in parameters:
+            lines.append('%s = %s' % (each, 0.5 if each.endswith('r') else 1.0))
+        lines.append('# InitVar')
+        for each in species:
+            lines.append(each + ' = 1.0')
+
+        with open(file_name, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    @staticmethod
+    def load_network(kind, size, directory=None, use_pysces=False):
+        """Returns network(kind, size) as a NumpyModel, or, when
+        use_pysces is True, writes it to a PySCeS input file and returns
+        the loaded PySCeS model. Files are written to directory (a new
+        temporary directory by default, which the caller has to remove)"""
+        if directory is None:
+            directory = mkdtemp(prefix='symca_benchmark_')
+        name = '%s_%d' % (kind, size)
+        reactions, fixed = SymcaBenchmark.network(kind, size)
+
+        if not use_pysces:
+            return NumpyModel(reactions, fixed, name=name, directory=directory)
+
+        import pysces
+
+        SymcaBenchmark.write_psc(path.join(directory, name + '.psc'),
+                                 reactions, fixed)
+        mod = pysces.model(name + '.psc', dir=directory)
+        mod.doLoad()
+        return mod
+
+    @staticmethod
+    def run_stages(mod, **options):
+        """
+        Runs the steps of Symca.do_symca on mod one by one and returns a
+        dictionary with a measurement (see measure) of each stage
+        extended with the size (see SymcaProfiler.expression_size) of
+        its input and output.
+
+        options are passed on to Symca. The det_<det_method> (e.g.
+        det_polynomial), adjugate_matrix and maxima_factor stages are the
+        steps of SymcaToolBox.invert for the whole matrix (without the
+        block triangular decomposition).
+        maxima_factor uses the backend chosen in options. Memory is the
+        peak resident set size of this process, so memory_increase is
+        only nonzero for stages that raise the peak.
+
+        If a stage raises an exception it is recorded as
+        {'failed': traceback} and the stages that need its result as
+        {'skipped': 'needs <stage>'}; the other stages still run.
+        """
+        from Symca import Symca
+
+        options.setdefault('cache', False)
+        sc = Symca(mod, **options)
+        temp = sc.path_to('temp')
+        stages = {}
+
+        def run(stage, function, args, inputs=()):
+            missing = [name for name in inputs
+                       if 'output_size' not in stages[name]]
+            if missing:
+                stages[stage] = {'skipped': 'needs ' + ', '.join(missing)}
+                return None
+            start = SymcaProfiler.start_measurement()
+            try:
+                result = function(*args)
+            except Exception:
+                stages[stage] = {'failed': traceback.format_exc()}
+                return None
+            stages[stage] = SymcaProfiler.stop_measurement(start)
+            if inputs:
+                stages[stage]['input_size'] = stages[inputs[0]]['output_size']
+            else:
+                stages[stage]['input_size'] = 0
+            stages[stage]['output_size'] = SymcaProfiler.expression_size(
+                result
+            )
+            return result
+
+        mod.SetQuiet()
+        mod.doMca()
+        ematrix = run('ematrix', lambda: sc.ematrix, ())
+
+        det_stage = 'det_' + sc.det_method
+        det = run(det_stage, SMCAtools.determinant,
+                  (ematrix, sc.det_method), ('ematrix',))
+        adjugate = run('adjugate_matrix', SMCAtools.adjugate_matrix,
+                       (ematrix, sc.adjugate_method), ('ematrix',))
+        common_denom_expr = run('maxima_factor', SMCAtools.factor,
+                                (det, temp, 1, sc.backend),
+                                (det_stage,))
+
+        cc_sol = run('solve_dep', SMCAtools.solve_dep,
+                     (adjugate, sc.scaled_k0, sc.scaled_l0,
+                      sc.num_ind_fluxes, temp, sc.workers, sc.backend),
+                     ('adjugate_matrix',))
+
+        fixed = run(
+            'fix_expressions', SMCAtools.fix_expressions,
+            (cc_sol, common_denom_expr, sc.lmatrix,
+             sc.species_independent, sc.species_dependent),
+            ('solve_dep', 'maxima_factor')
+        )
+
+        cc_names = SMCAtools.build_cc_matrix(
+            sc.fluxes,
+            sc.fluxes_independent,
+            sc.species_independent,
+            sc.fluxes_dependent,
+            sc.species_dependent
+        )
+
+        def spawn():
+            cc_objects = SMCAtools.spawn_cc_objects(
+                mod,
+                fixed[0],
+                cc_names,
+                fixed[1]
+            )
+            # include the splitting into control patterns
+            for cc in cc_objects[1:]:
+                cc.control_patterns
+            return [cc.expression for cc in cc_objects]
+
+        run('spawn_cc_objects', spawn, (), ('fix_expressions',))
+        mod.SetLoud()
+
+        return stages
+
+    @staticmethod
+    def run_suite(output_file, kinds=None, sizes=(3, 4, 5, 6, 8),
+                  use_pysces=False, **options):
+        """
+        Runs run_stages on every network family in kinds (all of
+        SymcaBenchmark.networks by default) at each size in sizes and
+        writes the results to output_file as JSON. The networks are
+        NumpyModel objects unless use_pysces is True. Every run is done
+        in its own process so that peak memory is measured per network.
+        A network whose process fails is recorded with the error as
+        'failed' and the suite continues with the next one (see
+        run_stages for failures of single stages). Returns the results.
+        """
+        if kinds is None:
+            kinds = SymcaBenchmark.networks
+
+        runs = []
+        for kind in kinds:
+            for size in sizes:
+                reactions, fixed = SymcaBenchmark.network(kind, size)
+                run = {
+                    'network': kind,
+                    'size': size,
+                    'reactions': len(reactions),
+                }
+                try:
+                    measurement, stages = SymcaBenchmark.measure(
+                        _run_network,
+                        kind,
+                        size,
+                        use_pysces,
+                        options
+                    )
+                except MeasurementError as error:
+                    run['failed'] = str(error)
+                    runs.append(run)
+                    print kind, size, 'failed'
+                    continue
+                run['total'] = measurement
+                run['stages'] = stages
+                runs.append(run)
+                failed = sorted(stage for stage in stages
+                                if 'failed' in stages[stage])
+                if failed:
+                    print kind, size, 'failed in', ', '.join(failed)
+                else:
+                    print kind, size, '%.2f s' % measurement['time']
+
+        results = {
+            'date': strftime('%Y-%m-%d %H:%M:%S'),
+            'revision': SymcaBenchmark._revision(),
+            'python': platform.python_version(),
+            'sympy': sympy_version,
+            'model': 'pysces' if use_pysces else 'numpy',
+            'options': options,
+            'runs': runs,
+        }
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        return results
+
+    @staticmethod
+    def _revision():
+        """The git revision of this code, if available"""
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                cwd=path.dirname(path.abspath(__file__)),
+                stderr=open(devnull, 'w')
+            ).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+def _run_network(kind, size, use_pysces, options):
+    directory = mkdtemp(prefix='symca_benchmark_')
+    try:
+        mod = SymcaBenchmark.load_network(kind, size, directory, use_pysces)
+        return SymcaBenchmark.run_stages(mod, **options)
+    finally:
+        rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Times the stages of symca on synthetic networks'
+    )
+    parser.add_argument('output_file')
+    parser.add_argument('--kinds', nargs='+', choices=SymcaBenchmark.networks)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[3, 4, 5, 6, 8])
+    parser.add_argument('--backend', default='maxima')
+    parser.add_argument('--pysces', action='store_true',
+                        help='use PySCeS models instead of NumpyModel')
+    arguments = parser.parse_args()
+
+    SymcaBenchmark.run_suite(
+        arguments.output_file,
+        arguments.kinds,
+        arguments.sizes,
+        arguments.pysces,
+        backend=arguments.backend
+    )
+
@@ -0,0 +1,78 @@
+import cPickle as pickle
+from hashlib import sha1
+from os import path, listdir, remove, rename, utime, getpid
+
+
+class SymcaCache(object):
+    """A content addressed store of symca results on disk.
+
+    Each result is pickled to its own file named after the key it is
+    stored under. When the files in the cache directory take up more
+    than max_size bytes the least recently used ones are removed."""
+
+    # change this when the format of the stored results changes
+    version = '2'
+
+    def __init__(self, directory, max_size=256 * 2 ** 20):
+        super(SymcaCache, self).__init__()
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def make_key(*items):
+        """Returns a hash of the string representations of items"""
+        digest = sha1(SymcaCache.version)
+        for item in items:
+            digest.update('\0' + str(item))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the result stored under key or None"""
+        file_name = self._file_name(key)
+        if not path.exists(file_name):
+            return None
+        try:
+            with open(file_name, 'rb') as f:
+                result = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+        # mark as recently used
+        utime(file_name, None)
+        return result
+
+    def put(self, key, result):
+        """Stores result under key and evicts old results if needed"""
+        file_name = self._file_name(key)
+        temp_name = file_name + '.' + str(getpid()) + '.tmp'
+        with open(temp_name, 'wb') as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        rename(temp_name, file_name)
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used results until the cache is no
+        larger than max_size"""
+        entries = []
+        for name in listdir(self.directory):
+            if name.endswith('.pkl'):
+                file_name = path.join(self.directory, name)
+                entries.append(
+                    (path.getmtime(file_name),
+                     path.getsize(file_name),
+                     file_name)
+                )
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, file_name in entries:
+            if total <= self.max_size:
+                break
+            remove(file_name)
+            total -= size
+
+    def clear(self):
+        for name in listdir(self.directory):
+            if name.endswith('.pkl'):
+                remove(path.join(self.directory, name))
+
+    def _file_name(self, key):
+        return path.join(self.directory, key + '.pkl')
@@ -0,0 +1,135 @@
+import cPickle as pickle
+import logging
+from os import path, listdir, remove, rename, mkdir, rmdir, getpid
+
+
+class SymcaCheckpoint(object):
+    """The intermediate results of an unfinished symca run.
+
+    Results of whole stages (e.g. the inverted ematrix) are pickled to
+    their own files with save() and read back with load(). The factored
+    control coefficient elements are appended one by one to a single
+    log file with add_element(), so that storing an element only costs
+    pickling that element. elements() reads them back after an
+    interruption; an incomplete last record (from a crash while it was
+    written) is ignored.
+
+    All files are kept in directory, which should be specific to the
+    model structure and the options of the run (see Symca.cache_key).
+    clear() removes them once the run is complete. options (anything
+    that can be pickled and compared) are stored with the results; if
+    the directory holds results stored with other options they are
+    removed instead of resumed.
+    """
+
+    _elements_file = 'elements.pkl'
+    _options_file = 'options'
+
+    def __init__(self, directory, options=None):
+        super(SymcaCheckpoint, self).__init__()
+        self.directory = directory
+        self.options = options
+        self._log = None
+        # size of the complete records in the elements file
+        self._valid_size = None
+        self._checked = False
+
+    def save(self, name, result):
+        """Stores the result of the stage name"""
+        self._make_directory()
+        self._dump(path.join(self.directory, name + '.pkl'), result)
+
+    def load(self, name):
+        """Returns the result of the stage name or None"""
+        self._check_options()
+        return self._read(path.join(self.directory, name + '.pkl'))
+
+    def add_element(self, index, expression):
+        """Appends the factored element with the given (flat) index"""
+        if self._log is None:
+            self._make_directory()
+            self._log = open(
+                path.join(self.directory, self._elements_file),
+                'ab'
+            )
+            # drop an incomplete record so that new ones can be read
+            if self._valid_size is not None:
+                self._log.truncate(self._valid_size)
+        pickle.dump((index, expression), self._log, pickle.HIGHEST_PROTOCOL)
+        self._log.flush()
+
+    def elements(self):
+        """Returns a dictionary {index: expression} of the stored
+        elements"""
+        self._check_options()
+        elements = {}
+        file_name = path.join(self.directory, self._elements_file)
+        self._valid_size = 0
+        if not path.exists(file_name):
+            return elements
+        with open(file_name, 'rb') as f:
+            while True:
+                try:
+                    index, expression = pickle.load(f)
+                except (EOFError, ValueError, KeyError, IndexError,
+                        pickle.UnpicklingError):
+                    break
+                elements[index] = expression
+                self._valid_size = f.tell()
+        return elements
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def clear(self):
+        """Removes all stored results"""
+        self.close()
+        if not path.exists(self.directory):
+            return
+        for name in listdir(self.directory):
+            remove(path.join(self.directory, name))
+        rmdir(self.directory)
+
+    def _make_directory(self):
+        self._check_options()
+        if not path.exists(self.directory):
+            mkdir(self.directory)
+            self._dump(
+                path.join(self.directory, self._options_file),
+                self.options
+            )
+
+    def _check_options(self):
+        """Removes the stored results if they were stored with other
+        options"""
+        if self._checked:
+            return
+        self._checked = True
+        if not path.exists(self.directory):
+            return
+        stored = self._read(path.join(self.directory, self._options_file))
+        if stored != self.options:
+            logging.warning(
+                'checkpoint %s was stored with the options %r instead of '
+                '%r, starting again' % (self.directory, stored, self.options)
+            )
+            self.clear()
+
+    @staticmethod
+    def _dump(file_name, result):
+        temp_name = file_name + '.' + str(getpid()) + '.tmp'
+        with open(temp_name, 'wb') as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        rename(temp_name, file_name)
+
+    @staticmethod
+    def _read(file_name, default=None):
+        if not path.exists(file_name):
+            return default
+        try:
+            with open(file_name, 'rb') as f:
+                return pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return default
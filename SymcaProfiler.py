@@ -0,0 +1,226 @@
+import sys
+import json
+import logging
+import resource
+from time import time, clock
+from sympy import count_ops
+
+
+class SymcaProfiler(object):
+    """Records the stages of a symca run.
+
+    For every stage the wall time, CPU time, peak memory (of this
+    process, so the work done by worker processes is not included), the
+    number of maxima calls and, if expression_sizes is True, the size of
+    the input and output expressions (see expression_size) are recorded. Stages can be
+    nested: a stage started inside another one is named
+    'outer/inner'.
+
+    A run is started with start() and ended with finish(), which returns
+    the report (a dictionary, see report()) and calls every function in
+    hooks with it. While a run is active the SymcaToolBox functions
+    record their own stages through the module level stage() and count()
+    functions. Outside a run these do nothing.
+
+    Expressions are only written to the log when log_expressions is
+    True and their sizes are only calculated when expression_sizes is
+    True, as converting large expressions to strings and counting their
+    operations is expensive.
+    """
+
+    # the profiler of the current run, used by stage() and count()
+    active = None
+
+    def __init__(self, log_expressions=False, expression_sizes=False):
+        super(SymcaProfiler, self).__init__()
+        self.log_expressions = log_expressions
+        self.expression_sizes = expression_sizes
+        # functions called as hook(report) by finish()
+        self.hooks = []
+
+        self.stages = []
+        self._open = []
+        self._start = None
+        # the profiler that was active before this one, see suspend()
+        self._previous = None
+
+    @staticmethod
+    def peak_memory():
+        """Peak resident set size of this process in bytes"""
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on OS X and in kilobytes elsewhere
+        if sys.platform != 'darwin':
+            peak = peak * 1024
+        return peak
+
+    @staticmethod
+    def start_measurement():
+        return time(), clock(), SymcaProfiler.peak_memory()
+
+    @staticmethod
+    def stop_measurement(start):
+        """Returns a dictionary with the wall time ('time') and CPU time
+        ('cpu_time') in seconds since start (as returned by
+        start_measurement), the peak memory ('peak_memory') and the
+        increase in peak memory since start ('memory_increase') in
+        bytes"""
+        start_time, start_cpu, start_memory = start
+        peak_memory = SymcaProfiler.peak_memory()
+        return {
+            'time': time() - start_time,
+            'cpu_time': clock() - start_cpu,
+            'peak_memory': peak_memory,
+            'memory_increase': peak_memory - start_memory,
+        }
+
+    @staticmethod
+    def expression_size(expression):
+        """The number of operations in an expression or in all elements
+        of a matrix, list or tuple"""
+        if isinstance(expression, (list, tuple)):
+            return sum(SymcaProfiler.expression_size(e) for e in expression)
+        if getattr(expression, 'is_Matrix', False):
+            return sum(count_ops(e) for e in expression)
+        return count_ops(expression)
+
+    def start(self):
+        """Starts a new run (and forgets the stages of the last one)"""
+        self.stages = []
+        self._open = []
+        self._start = SymcaProfiler.start_measurement()
+        self.resume()
+
+    def finish(self):
+        """Ends the run, calls the hooks and returns the report"""
+        self.suspend()
+        report = self.report()
+        for hook in self.hooks:
+            hook(report)
+        return report
+
+    def suspend(self):
+        """Makes the profiler that was active when this one was started
+        (or resumed) the active one again. Used while a generator that
+        runs the stages is suspended, so that the stages run by its
+        caller in the meantime are not recorded in this run."""
+        if SymcaProfiler.active is self:
+            SymcaProfiler.active = self._previous
+        self._previous = None
+
+    def resume(self):
+        """Makes this profiler the active one again after suspend()"""
+        if SymcaProfiler.active is not self:
+            self._previous = SymcaProfiler.active
+            SymcaProfiler.active = self
+
+    def report(self):
+        """
+        Returns a dictionary with a list of the finished stages
+        ('stages') in the order in which they were started and the
+        measurement of the whole run ('total'). Each stage is a
+        dictionary with its name, the measurement (see stop_measurement),
+        'maxima_calls' and, if expression_sizes is True and the stage has
+        inputs or outputs, 'input_size' and 'output_size'.
+        """
+        total = None
+        if self._start:
+            total = SymcaProfiler.stop_measurement(self._start)
+        return {
+            'stages': [stage for stage in self.stages if 'time' in stage],
+            'total': total,
+        }
+
+    def to_json(self, file_name=None):
+        """Returns the report as a JSON string and writes it to file_name
+        if given"""
+        text = json.dumps(self.report(), indent=1, sort_keys=True)
+        if file_name:
+            with open(file_name, 'w') as f:
+                f.write(text)
+        return text
+
+    def stage(self, name, *inputs):
+        """Returns a context manager that records the stage name. inputs
+        are the expressions the stage works on. Call output() on the
+        object returned by the with statement to record the result."""
+        return _Stage(self, name, inputs)
+
+    def count(self, counter, n=1):
+        """Adds n to counter in every stage that is currently running"""
+        for record in self._open:
+            record[counter] = record.get(counter, 0) + n
+
+
+class _Stage(object):
+    def __init__(self, profiler, name, inputs):
+        self.profiler = profiler
+        if profiler._open:
+            name = profiler._open[-1]['name'] + '/' + name
+        self.record = {'name': name, 'maxima_calls': 0}
+        self._inputs = inputs
+        self._start = None
+
+    def __enter__(self):
+        profiler = self.profiler
+        if self._inputs:
+            if profiler.expression_sizes:
+                self.record['input_size'] = SymcaProfiler.expression_size(
+                    self._inputs
+                )
+            if profiler.log_expressions:
+                logging.info('%s input:' % self.record['name'])
+                for each in self._inputs:
+                    logging.info(each)
+        self._inputs = None
+        profiler.stages.append(self.record)
+        profiler._open.append(self.record)
+        self._start = SymcaProfiler.start_measurement()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record = self.record
+        record.update(SymcaProfiler.stop_measurement(self._start))
+        self.profiler._open.remove(record)
+        logging.info(
+            '%s: %.2f s (%.2f s CPU), %d maxima calls, peak memory %.1f MB'
+            % (record['name'], record['time'], record['cpu_time'],
+               record['maxima_calls'], record['peak_memory'] / 2.0 ** 20)
+        )
+        return False
+
+    def output(self, *results):
+        """Records the size of results (and logs them if the profiler
+        logs expressions)"""
+        if self.profiler.expression_sizes:
+            self.record['output_size'] = SymcaProfiler.expression_size(
+                results
+            )
+        if self.profiler.log_expressions:
+            logging.info('%s output:' % self.record['name'])
+            for each in results:
+                logging.info(each)
+
+
+class _NoStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def output(self, *results):
+        pass
+
+
+def stage(name, *inputs):
+    """SymcaProfiler.active.stage(name, *inputs) if a run is active,
+    otherwise a context manager that does nothing"""
+    if SymcaProfiler.active is None:
+        return _NoStage()
+    return SymcaProfiler.active.stage(name, *inputs)
+
+
+def count(counter, n=1):
+    """SymcaProfiler.active.count(counter, n) if a run is active"""
+    if SymcaProfiler.active is not None:
+        SymcaProfiler.active.count(counter, n)
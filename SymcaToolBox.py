@@ -1,19 +1,58 @@
 import subprocess
-from os import devnull, path, mkdir
+from os import devnull, path, mkdir, getpid
+from shutil import rmtree
+from tempfile import mkdtemp
 import sys
+from collections import deque
+from multiprocessing import Pool
 from re import sub
-from sympy import Symbol, sympify, nsimplify, fraction, S
-from sympy.matrices import Matrix, diag, NonSquareMatrixError
-from CCobjects import CCBase, CCoef
+from sympy import Symbol, sympify, nsimplify, fraction, together, S, Float
+from sympy.polys.fields import sfield
+from sympy.matrices import Matrix, diag, eye, zeros, NonSquareMatrixError
+from CCobjects import CCBase, CCoef, CCEvaluator
+from MaximaSession import MaximaPool
+from ModelValues import ModelValues
+import SymcaProfiler as profiling
 import logging
 
 
+# temp directory and backend function of the current factoring worker
+# process (see SymcaToolBox.factor). Each worker gets its own directory (inside the
+# directory of its pool, which is removed with the pool) so that the
+# in.txt/out.txt files used by maxima_batch_factor do not clash.
+_worker_path = None
+_worker_backend = None
+
+
+def _init_factor_worker(path_to, factor_element):
+    global _worker_path, _worker_backend
+    _worker_path = path_to + 'worker_' + str(getpid()) + '/'
+    _worker_backend = factor_element
+    if not path.exists(_worker_path):
+        mkdir(_worker_path)
+
+
+def _factor_element(expression):
+    return _worker_backend(expression, _worker_path)
+
+
 class SymcaToolBox(object):
     """The class with the functions used to populate SymcaData. The project is
     structured in this way to abstract the 'work' needed to build the various
     matrices away from the SymcaData class. This 'toolbox' does only has
     a filename variable used for temp storage of maxima output"""
 
+    # Expressions are factored by long-lived maxima processes. Set
+    # use_maxima_session to False to fall back to one 'maxima --batch'
+    # call per expression.
+    maxima_pool = MaximaPool()
+    use_maxima_session = True
+
+    # Simplification backends used by factor(). Each name maps to a
+    # function that takes a single expression and path_to, see
+    # register_backend. 'maxima' and 'sympy' are registered below the
+    # class.
+    backends = {}
 
     # @staticmethod
     # def make_path(mod,subdir,subsubdir = None):
@@ -126,42 +165,37 @@ class SymcaToolBox(object):
         return scaled_matrix
 
     @staticmethod
-    def get_es_matrix(mod, nmatrix, fluxes, species):
+    def get_es_matrix(mod, nmatrix, fluxes, species, values=None):
         """
         Gets the esmatrix.
 
-        Goes down the columns of the nmatrix (which holds the fluxes)
-        to get the rows of the esmatrix.
-
-        Nested loop goes down the rows of the nmatrix (which holds the species)
-        to get the columns of the esmatrix
-
-        so the format is
+        The rows of the esmatrix are the fluxes (the columns of the
+        nmatrix) and its columns are the species (the rows of the
+        nmatrix):
 
         ecReationN0_M0 ecReationN0_M1 ecReationN0_M2
         ecReationN1_M0 ecReationN1_M1 ecReationN1_M2
         ecReationN2_M0 ecReationN2_M1 ecReationN2_M2
-        """
-        nmat = nmatrix
-
-        elas = []
-
-        for col in range(nmat.cols):
-            current_reaction = fluxes[col]
-            elas_row = []
-            for row in range(nmat.rows):
-                current_species = species[row]
-                ec_name = 'ec' + str(current_reaction)[2:] + '_' + str(current_species)
-                cond1 = getattr(mod, ec_name) != 0
 
-                if cond1:
-                    elas_row.append(ec_name)
-                else:
-                    elas_row.append(0)
-            elas.append(elas_row)
-
-        esmatrix = Matrix(elas)
-        return esmatrix
+        Elasticities that are zero in the model are left out. Their
+        values are read in one go from the elasticity array of the model
+        through values (a ModelValues object for mod).
+        """
+        if values is None:
+            values = ModelValues(mod)
+
+        reactions = [str(flux)[2:] for flux in fluxes]
+        species = [str(each) for each in species]
+        elas = values.elasticities(reactions, species)
+        nonzero = elas != 0
+
+        return Matrix(
+            nmatrix.cols,
+            nmatrix.rows,
+            lambda i, j: Symbol(
+                'ec' + reactions[i] + '_' + species[j]
+            ) if nonzero[i, j] else 0
+        )
 
     @staticmethod
     def simplify_matrix(matrix):
@@ -175,11 +209,145 @@ class SymcaToolBox(object):
         return m
 
     @staticmethod
-    def adjugate_matrix(matrix):
+    def adjugate_matrix(matrix, method='bareiss'):
         """
         Returns the adjugate matrix which is the transpose of the
         cofactor matrix.
 
+        method is either 'bareiss' (see adjugate_bareiss) or 'minors'
+        (see adjugate_minors). Both give the same adjugate once the
+        elements are simplified, 'bareiss' is much faster for larger
+        matrices. 'bareiss' falls back to 'minors' for singular matrices.
+
+        Elements that are zero because of the sparsity pattern of matrix
+        (see adjugate_zeros) are set to zero; 'minors' does not calculate
+        them at all.
+        """
+        if method not in ('bareiss', 'minors'):
+            raise ValueError("`method` must be 'bareiss' or 'minors'")
+        with profiling.stage('adjugate', matrix) as stage:
+            zeros = SymcaToolBox.adjugate_zeros(matrix) or set()
+            adjugate = None
+            if method == 'bareiss':
+                adjugate = SymcaToolBox.adjugate_bareiss(matrix)
+            if adjugate is None:
+                adjugate = SymcaToolBox.adjugate_minors(matrix, zeros)
+            # without cancel() these are not always simplified to zero
+            for i, j in zeros:
+                adjugate[i, j] = 0
+            SymcaToolBox._report_zeros(len(zeros), len(adjugate))
+            stage.output(adjugate)
+        return adjugate
+
+    @staticmethod
+    def adjugate_rows(matrix, rows, method='bareiss'):
+        """
+        Returns the rows of the adjugate matrix with the indices in rows
+        (in that order) as a len(rows) x n matrix.
+
+        With 'bareiss' only these rows are calculated: row r of adj(M)
+        is column r of adj(M^T), which adjugate_bareiss calculates by
+        augmenting M^T with the unit vector e_r only. 'minors' (and
+        'bareiss' for a singular matrix) calculates the whole adjugate.
+        """
+        if method not in ('bareiss', 'minors'):
+            raise ValueError("`method` must be 'bareiss' or 'minors'")
+        with profiling.stage('adjugate_rows', matrix) as stage:
+            zeros = SymcaToolBox.adjugate_zeros(matrix) or set()
+            adjugate = None
+            if method == 'bareiss':
+                adjugate = SymcaToolBox.adjugate_bareiss(matrix.T, rows)
+                if adjugate is not None:
+                    adjugate = adjugate.T
+            if adjugate is None:
+                adjugate = SymcaToolBox.adjugate_minors(
+                    matrix,
+                    zeros
+                ).extract(rows, range(matrix.cols))
+            num_zeros = 0
+            for a, i in enumerate(rows):
+                for j in range(matrix.cols):
+                    if (i, j) in zeros:
+                        adjugate[a, j] = 0
+                        num_zeros += 1
+            SymcaToolBox._report_zeros(num_zeros, len(adjugate))
+            stage.output(adjugate)
+        return adjugate
+
+    @staticmethod
+    def _report_zeros(num_zeros, size):
+        logging.info(
+            '%d of %d adjugate elements are structurally zero'
+            % (num_zeros, size)
+        )
+        profiling.count('structural_zeros', num_zeros)
+
+    @staticmethod
+    def adjugate_bareiss(matrix, columns=None):
+        """
+        Returns the adjugate matrix calculated with a single fraction-free
+        Gauss-Jordan elimination of the matrix augmented with the identity
+        matrix.
+
+        After eliminating every column the augmented matrix has the form
+        [d*I | d*inverse] where d is the determinant (up to the sign
+        of the row swaps) so that the right hand block is the adjugate.
+        As with det_bareis, cancel() is not called on the elements.
+
+        If columns (a list of column indices) is given the matrix is only
+        augmented with these columns of the identity matrix and only
+        these columns of the adjugate are returned.
+
+        Returns None if the matrix is singular.
+        """
+        mat = matrix
+        if not mat.is_square:
+            raise NonSquareMatrixError()
+
+        n = mat.rows
+        if columns is None:
+            columns = range(n)
+        m = mat.row_join(eye(n).extract(range(n), columns))
+        width = m.cols
+        sign = 1
+        pivot = 1
+
+        for k in range(n):
+            if m[k, k] == 0:
+                for i in range(k + 1, n):
+                    if m[i, k] != 0:
+                        m.row_swap(i, k)
+                        sign *= -1
+                        break
+                else:
+                    return None
+
+            # same update as in det_bareis, but applied to the rows above
+            # the pivot as well
+            for i in range(n):
+                if i == k:
+                    continue
+                for j in range(k + 1, width):
+                    d = m[k, k] * m[i, j] - m[i, k] * m[k, j]
+
+                    if k > 0:
+                        d /= pivot
+
+                    m[i, j] = d
+                m[i, k] = 0
+
+            pivot = m[k, k]
+
+        return sign * m[:, n:]
+
+    @staticmethod
+    def adjugate_minors(matrix, zeros=()):
+        """
+        Returns the adjugate matrix which is the transpose of the
+        cofactor matrix. Each cofactor is calculated separately with
+        det_bareis, except for the adjugate elements (i, j) in zeros
+        which are known to be zero (see adjugate_zeros).
+
         Contains code adapted from sympy.
         Specifically:
 
@@ -192,7 +360,7 @@ class SymcaToolBox(object):
 
         def cofactor_matrix(mat):
             out = Matrix(mat.rows, mat.cols, lambda i, j:
-            cofactor(mat, i, j))
+            0 if (j, i) in zeros else cofactor(mat, i, j))
             return out
 
         def minor_entry(mat, i, j):
@@ -219,6 +387,23 @@ class SymcaToolBox(object):
 
         return cofactor_matrix(matrix).transpose()
 
+    @staticmethod
+    def determinant(matrix, method='polynomial'):
+        """
+        Returns the determinant of matrix calculated with either
+        det_bareis_poly ('polynomial') or det_bareis ('bareiss').
+        """
+        methods = {
+            'polynomial': SymcaToolBox.det_bareis_poly,
+            'bareiss': SymcaToolBox.det_bareis,
+        }
+        if method not in methods:
+            raise ValueError("`method` must be 'polynomial' or 'bareiss'")
+        with profiling.stage('determinant', matrix) as stage:
+            det = methods[method](matrix)
+            stage.output(det)
+        return det
+
     @staticmethod
     def det_bareis(matrix):
         """
@@ -241,7 +426,10 @@ class SymcaToolBox(object):
 
         m, n = mat[:, :], mat.rows
 
-        if n == 1:
+        if n == 0:
+            # e.g. the minors of a 1 x 1 matrix in adjugate_minors
+            det = S.One
+        elif n == 1:
             det = m[0, 0]
         elif n == 2:
             det = m[0, 0] * m[1, 1] - m[0, 1] * m[1, 0]
@@ -276,15 +464,99 @@ class SymcaToolBox(object):
         return det
 
     @staticmethod
-    def invert(matrix,path_to):
+    def det_bareis_poly(matrix):
+        """
+        Bareis' fraction-free determinant (see det_bareis) with the
+        elements stored as sparse multivariate polynomials.
+
+        Every row is first multiplied by the lcm of the denominators of
+        its elements so that all elements are polynomials. The divisions
+        by the previous pivot are then exact polynomial divisions, so
+        the intermediate elements stay expanded polynomials instead of
+        growing into nested fractions. The determinant of the scaled
+        matrix is divided by the product of the row multipliers at the
+        end.
+        """
+        mat = matrix
+        if not mat.is_square:
+            raise NonSquareMatrixError()
+
+        n = mat.rows
+        if not any(e.free_symbols for e in mat):
+            return SymcaToolBox.det_bareis(mat)
+
+        field, elements = sfield(list(mat))
+        ring = field.ring
+
+        m = []
+        scale = ring.one
+        for i in range(n):
+            row = elements[i * n:(i + 1) * n]
+            multiplier = ring.one
+            for e in row:
+                multiplier = multiplier.lcm(e.denom)
+            scale *= multiplier
+            m.append([e.numer * multiplier.exquo(e.denom) for e in row])
+
+        sign = 1 # track current sign in case of row swap
+
+        for k in range(n - 1):
+            if not m[k][k]:
+                for i in range(k + 1, n):
+                    if m[i][k]:
+                        m[i], m[k] = m[k], m[i]
+                        sign *= -1
+                        break
+                else:
+                    return S.Zero
+
+            for i in range(k + 1, n):
+                for j in range(k + 1, n):
+                    d = m[k][k] * m[i][j] - m[i][k] * m[k][j]
+
+                    if k > 0:
+                        d = d.exquo(m[k - 1][k - 1])
+
+                    m[i][j] = d
+
+        det = sign * m[n - 1][n - 1]
+        return det.as_expr() / scale.as_expr()
+
+    @staticmethod
+    def invert(matrix, path_to, adjugate_method='bareiss',
+               block_decompose=True, backend='maxima',
+               det_method='polynomial'):
         """
         Returns the numerators of the inverted martix separately from the
         common denominator (the determinant of the matrix)
+
+        adjugate_method is passed on to adjugate_matrix, det_method on
+        to determinant and backend on to factor
+
+        If block_decompose is True and the matrix can be permuted to
+        block triangular form with more than one block the inversion
+        is done per block (see invert_block_triangular).
         """
-        common_denom = SymcaToolBox.det_bareis(matrix)
-        adjugate = SymcaToolBox.adjugate_matrix(matrix)
+        if block_decompose:
+            btf = SymcaToolBox.block_triangular_form(matrix)
+            if btf and len(btf[2]) > 1:
+                return SymcaToolBox.invert_block_triangular(
+                    matrix,
+                    btf,
+                    path_to,
+                    adjugate_method,
+                    backend,
+                    det_method
+                )
 
-        common_denom = SymcaToolBox.maxima_factor(common_denom, path_to)
+        common_denom = SymcaToolBox.determinant(matrix, det_method)
+        adjugate = SymcaToolBox.adjugate_matrix(matrix, adjugate_method)
+
+        common_denom = SymcaToolBox.factor(
+            common_denom,
+            path_to,
+            backend=backend
+        )
         #adjugate     = self._maxima_factor('/home/carl/test.txt',adjugate)
 
 
@@ -292,54 +564,457 @@ class SymcaToolBox(object):
         return cc_i_sol
 
     @staticmethod
-    def maxima_factor(expression,path_to):
+    def block_triangular_form(matrix):
         """
-        This function is equivalent to the sympy.cancel()
-        function but uses maxima instead
+        Finds row and column permutations that bring the matrix to
+        upper block triangular form.
+
+        First a maximum matching between rows and nonzero columns
+        gives a column order with a zero free diagonal. The strongly
+        connected components (Tarjan) of the graph with an edge i -> j
+        for every nonzero element (i, j) of that matrix are then the
+        diagonal blocks.
+
+        Returns (rows, cols, blocks) where matrix.extract(rows, cols) is
+        block triangular and blocks is a list of (start, end) indices of
+        the diagonal blocks. Returns None if the matrix is structurally
+        singular.
         """
+        if not matrix.is_square:
+            raise NonSquareMatrixError()
+
+        n = matrix.rows
+        nonzero = SymcaToolBox._nonzero_pattern(matrix)
+        col_match = SymcaToolBox._perfect_matching(nonzero)
+        if col_match is None:
+            return None
+
+        row_match = [None] * n
+        for j, i in enumerate(col_match):
+            row_match[i] = j
+        col_of = dict((j, i) for i, j in enumerate(row_match))
+
+        # Tarjan's strongly connected components on the permuted matrix
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        def connect(v):
+            index[v] = lowlink[v] = len(index)
+            stack.append(v)
+            on_stack.add(v)
+            for w in (col_of[j] for j in nonzero[v]):
+                if w not in index:
+                    connect(w)
+                    lowlink[v] = min(lowlink[v], lowlink[w])
+                elif w in on_stack:
+                    lowlink[v] = min(lowlink[v], index[w])
+            if lowlink[v] == index[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack.discard(w)
+                    component.append(w)
+                    if w == v:
+                        break
+                components.append(sorted(component))
+
+        for v in range(n):
+            if v not in index:
+                connect(v)
+
+        # Tarjan finds the components in reverse topological order
+        components.reverse()
+        order = []
+        blocks = []
+        for component in components:
+            blocks.append((len(order), len(order) + len(component)))
+            order.extend(component)
+
+        rows = order
+        cols = [row_match[i] for i in order]
+        return rows, cols, blocks
+
+    @staticmethod
+    def _nonzero_pattern(matrix):
+        """The column indices of the nonzero elements of each row"""
+        return [[j for j in range(matrix.cols) if matrix[i, j] != 0]
+                for i in range(matrix.rows)]
+
+    @staticmethod
+    def _perfect_matching(nonzero):
+        """
+        Returns a list with the row matched to each column in a maximum
+        matching (found with augmenting paths) of the rows and nonzero
+        columns given by nonzero (see _nonzero_pattern). Returns None if
+        there is no perfect matching, i.e. the matrix is structurally
+        singular.
+        """
+        n = len(nonzero)
+        col_match = [None] * n
+
+        def augment(i, visited):
+            for j in nonzero[i]:
+                if j not in visited:
+                    visited.add(j)
+                    if col_match[j] is None or augment(col_match[j], visited):
+                        col_match[j] = i
+                        return True
+            return False
+
+        for i in range(n):
+            if not augment(i, set()):
+                return None
+        return col_match
+
+    @staticmethod
+    def adjugate_zeros(matrix):
+        """
+        Returns the set of indices (i, j) of the elements of the adjugate
+        of matrix that are zero because of its sparsity pattern alone,
+        whatever the values of the nonzero elements. Returns None if the
+        matrix is structurally singular.
+
+        adj[i, j] is (up to its sign) the determinant of matrix without
+        row j and column i, which is structurally zero if that minor has
+        no perfect matching. Given a perfect matching of matrix, where
+        column i is matched to row p, the minor has one if and only if
+        row j can be reached from row p in the graph with an edge
+        a -> b for every nonzero matrix[a, column matched to row b]
+        (shifting each row along the path to the column of the next
+        row frees up the column of row j).
+        """
+        if not matrix.is_square:
+            raise NonSquareMatrixError()
+
+        n = matrix.rows
+        nonzero = SymcaToolBox._nonzero_pattern(matrix)
+        col_match = SymcaToolBox._perfect_matching(nonzero)
+        if col_match is None:
+            return None
+
+        zeros = set()
+        for i in range(n):
+            start = col_match[i]
+            reached = set([start])
+            stack = [start]
+            while stack:
+                a = stack.pop()
+                for column in nonzero[a]:
+                    b = col_match[column]
+                    if b not in reached:
+                        reached.add(b)
+                        stack.append(b)
+            for j in range(n):
+                if j not in reached:
+                    zeros.add((i, j))
+        return zeros
+
+    @staticmethod
+    def invert_block_triangular(matrix, btf, path_to, adjugate_method,
+                                backend='maxima', det_method='polynomial'):
+        """
+        Same as invert but works on the diagonal blocks of the block
+        triangular form btf (as returned by block_triangular_form).
+
+        The determinant is the product of the block determinants. The
+        adjugate of T = matrix.extract(rows, cols) is assembled from the
+        block adjugates with block back substitution, without divisions:
+
+            Z_jj = adj(T_jj)
+            Z_ij = -adj(T_ii) * sum_k T_ik * Z_kj * det(T_i+1)...det(T_k-1)
+
+        where block (i, j) of adj(T) is Z_ij times the determinants of the
+        blocks outside i..j. The adjugate of matrix then follows from
+        undoing the permutations.
+        """
+        rows, cols, blocks = btf
+        n = matrix.rows
+        t = matrix.extract(rows, cols)
+
+        dets = []
+        adjs = []
+        for start, end in blocks:
+            block = t[start:end, start:end]
+            dets.append(SymcaToolBox.determinant(block, det_method))
+            adjs.append(SymcaToolBox.adjugate_matrix(block, adjugate_method))
+
+        z = {}
+        for j in range(len(blocks)):
+            z[j, j] = adjs[j]
+            size_j = blocks[j][1] - blocks[j][0]
+            for i in range(j - 1, -1, -1):
+                si, ei = blocks[i]
+                total = zeros(ei - si, size_j)
+                scale = 1
+                for k in range(i + 1, j + 1):
+                    sk, ek = blocks[k]
+                    t_ik = t[si:ei, sk:ek]
+                    if any(e != 0 for e in t_ik):
+                        total += t_ik * z[k, j] * scale
+                    scale *= dets[k]
+                z[i, j] = -1 * adjs[i] * total
+
+        sign = (SymcaToolBox._permutation_sign(rows) *
+                SymcaToolBox._permutation_sign(cols))
+
+        adjugate = zeros(n, n)
+        for i, (si, ei) in enumerate(blocks):
+            for j in range(i, len(blocks)):
+                sj, ej = blocks[j]
+                outside = sign
+                for m in range(len(blocks)):
+                    if not i <= m <= j:
+                        outside *= dets[m]
+                z_ij = z[i, j]
+                for a in range(ei - si):
+                    for b in range(ej - sj):
+                        # adj(matrix)[cols[a], rows[b]] = sign*adj(T)[a, b]
+                        adjugate[cols[si + a], rows[sj + b]] = \
+                            outside * z_ij[a, b]
+
+        num = sign
+        denom = 1
+        for det in dets:
+            det_num, det_denom = fraction(
+                SymcaToolBox.factor(det, path_to, backend=backend)
+            )
+            num *= det_num
+            denom *= det_denom
+        common_denom = num.expand() / denom.expand()
+
+        cc_i_sol = adjugate, common_denom
+        return cc_i_sol
+
+    @staticmethod
+    def _permutation_sign(permutation):
+        sign = 1
+        seen = set()
+        for start in range(len(permutation)):
+            if start in seen:
+                continue
+            length = 0
+            i = start
+            while i not in seen:
+                seen.add(i)
+                i = permutation[i]
+                length += 1
+            if length % 2 == 0:
+                sign = -sign
+        return sign
+
+    @staticmethod
+    def factor(expression, path_to, workers=1, backend='maxima'):
+        """
+        Puts expression (or each element of a matrix) on a single
+        expanded numerator and denominator with common factors removed,
+        i.e. the equivalent of sympy.cancel(), using the simplification
+        backend 'backend' (see SymcaToolBox.backends).
+
+        When expression is a matrix and workers is larger than 1 the
+        elements are factored by a pool of worker processes. Each worker
+        has its own temp directory inside path_to, which is removed when
+        the pool is done. The elements of the returned matrix are in the
+        same order as those of expression.
+        """
+        factor_element = SymcaToolBox._backend(backend)
+        with profiling.stage('factor', expression) as stage:
+            if not expression.is_Matrix:
+                result = factor_element(expression, path_to)
+                stage.output(result)
+                return result
 
-        maxima_in_file = path_to + 'in.txt'
-        maxima_out_file = path_to + 'out.txt'
-        if expression.is_Matrix:
             expr_mat = expression[:, :]
             #print expr_mat
             print 'Simplifying matrix with ' + str(len(expr_mat)) + ' elements'
-            for i, e in enumerate(expr_mat):
-
-                sys.stdout.write('*')
-                sys.stdout.flush()
-                if (i + 1) % 50 == 0:
-                    sys.stdout.write(' ' + str(i + 1) + '\n')
-                    sys.stdout.flush()
-                #print e
-                expr_mat[i] = SymcaToolBox.maxima_factor(e,path_to)
+            results = SymcaToolBox.iter_factor(
+                list(expr_mat),
+                path_to,
+                workers,
+                backend
+            )
+            for i, e in enumerate(results):
+                SymcaToolBox._progress(i)
+                expr_mat[i] = e
             sys.stdout.write('\n')
             sys.stdout.flush()
-            return expr_mat
+            stage.output(expr_mat)
+        return expr_mat
+
+    @staticmethod
+    def iter_factor(expressions, path_to, workers=1, backend='maxima'):
+        """
+        Factors each expression in the iterable expressions (see factor)
+        and yields the results in the same order, each one as soon as it
+        is done. With more than one worker the expressions are factored
+        by a pool of worker processes.
+
+        Expressions without symbols (e.g. the structural zeros of the
+        control matrix, see adjugate_zeros) are yielded as they are.
+        The number of these is counted as 'skipped_elements' by the
+        profiler.
+        """
+        factor_element = SymcaToolBox._backend(backend)
+        if workers > 1:
+            # removed with the temp directories of the workers below
+            pool_path = mkdtemp(prefix='workers_', dir=path_to) + '/'
+            pool = Pool(
+                workers,
+                initializer=_init_factor_worker,
+                initargs=(pool_path, factor_element)
+            )
+            # only a few expressions are queued at a time so that the
+            # pool can be terminated when the caller stops early
+            pending = deque()
+            expressions = iter(expressions)
+            try:
+                while True:
+                    while len(pending) < 2 * workers:
+                        try:
+                            e = next(expressions)
+                        except StopIteration:
+                            break
+                        if not e.free_symbols:
+                            pending.append((False, e))
+                            continue
+                        pending.append(
+                            (True, pool.apply_async(_factor_element, (e,)))
+                        )
+                    if not pending:
+                        break
+                    factored, e = pending.popleft()
+                    if not factored:
+                        profiling.count('skipped_elements')
+                        yield e
+                        continue
+                    # the workers cannot count their own maxima calls
+                    if backend == 'maxima':
+                        profiling.count('maxima_calls')
+                    yield e.get()
+            finally:
+                pool.terminate()
+                pool.join()
+                rmtree(pool_path, ignore_errors=True)
         else:
-            batch_string = (
-                'stardisp:true;stringout("'
-                + maxima_out_file + '",factor(' + str(expression) + '));')
-            #print batch_string
-            with open(maxima_in_file, 'w') as f:
-                f.write(batch_string)
+            for e in expressions:
+                if not e.free_symbols:
+                    profiling.count('skipped_elements')
+                    yield e
+                else:
+                    yield factor_element(e, path_to)
 
-            maxima_command = ['maxima', '--batch=' + maxima_in_file]
+    @staticmethod
+    def register_backend(name, function):
+        """
+        Adds function as the simplification backend name, which can then
+        be passed as backend to factor, invert, solve_dep and Symca.
+
+        function is called as function(expression, path_to) for every
+        expression that contains symbols and has to return it as a
+        single expanded numerator over an expanded denominator with
+        common factors removed (see factor). path_to is a temp directory
+        that function may use; it is separate for each worker process.
+        A backend registered under an existing name replaces it.
+        """
+        SymcaToolBox.backends[name] = function
 
-            dn = open(devnull, 'w')
-            subprocess.call(maxima_command, stdin=dn, stdout=dn, stderr=dn)
-            simplified_expression = ''
+    @staticmethod
+    def _backend(name):
+        """The function of the simplification backend name"""
+        if name not in SymcaToolBox.backends:
+            raise ValueError(
+                '`backend` must be one of ' +
+                ', '.join(sorted(SymcaToolBox.backends))
+            )
+        return SymcaToolBox.backends[name]
 
-            with open(maxima_out_file) as f:
-                for line in f:
-                    if line != '\n':
-                        simplified_expression = line[:-2]
-            frac = fraction(sympify(simplified_expression))
-            #print frac[0].expand()/frac[1].expand()
-            return frac[0].expand() / frac[1].expand()
+    @staticmethod
+    def maxima_factor(expression, path_to, workers=1):
+        """
+        This function is equivalent to the sympy.cancel()
+        function but uses maxima instead
+        """
+        return SymcaToolBox.factor(expression, path_to, workers, 'maxima')
 
     @staticmethod
-    def solve_dep(cc_i_num, scaledk0, scaledl0, num_ind_fluxes,path_to):
+    def _maxima_factor_element(expression, path_to):
+        profiling.count('maxima_calls')
+        if SymcaToolBox.use_maxima_session:
+            simplified_expression = SymcaToolBox.maxima_pool.factor(
+                str(expression)
+            )
+        else:
+            simplified_expression = SymcaToolBox.maxima_batch_factor(
+                expression,
+                path_to
+            )
+        frac = fraction(sympify(simplified_expression))
+        #print frac[0].expand()/frac[1].expand()
+        return frac[0].expand() / frac[1].expand()
+
+    @staticmethod
+    def _sympy_factor_element(expression, path_to):
+        """
+        Cancels expression in a sparse rational function field over its
+        symbols (e.g. ZZ(ec..., J_...)). Needs neither maxima nor any
+        string conversion. The numerator and denominator of the field
+        element are already expanded polynomials.
+        """
+        if not expression.free_symbols:
+            return expression
+        if expression.has(Float):
+            # floats (e.g. from the k or l matrix) would give a field
+            # over RR in which cancelling is not exact
+            expression = expression.xreplace(dict(
+                (f, nsimplify(f, rational=True))
+                for f in expression.atoms(Float)
+            ))
+        # sfield is slow on nested fractions (as produced by the
+        # adjugate of a matrix with rational elements), so these are put
+        # on a single denominator first
+        field, frac = sfield(together(expression))
+        return frac.numer.as_expr() / frac.denom.as_expr()
+
+    @staticmethod
+    def _progress(i):
+        sys.stdout.write('*')
+        sys.stdout.flush()
+        if (i + 1) % 50 == 0:
+            sys.stdout.write(' ' + str(i + 1) + '\n')
+            sys.stdout.flush()
+
+    @staticmethod
+    def maxima_batch_factor(expression, path_to):
+        """
+        Factors a single expression by running 'maxima --batch' on a
+        file in path_to. Returns the result as a string.
+        """
+        maxima_in_file = path_to + 'in.txt'
+        maxima_out_file = path_to + 'out.txt'
+        batch_string = (
+            'stardisp:true;stringout("'
+            + maxima_out_file + '",factor(' + str(expression) + '));')
+        #print batch_string
+        with open(maxima_in_file, 'w') as f:
+            f.write(batch_string)
+
+        maxima_command = ['maxima', '--batch=' + maxima_in_file]
+
+        dn = open(devnull, 'w')
+        subprocess.call(maxima_command, stdin=dn, stdout=dn, stderr=dn)
+        simplified_expression = ''
+
+        with open(maxima_out_file) as f:
+            for line in f:
+                if line != '\n':
+                    simplified_expression = line[:-2]
+        return simplified_expression
+
+    @staticmethod
+    def solve_dep(cc_i_num, scaledk0, scaledl0, num_ind_fluxes, path_to,
+                  workers=1, backend='maxima'):
         """
         Calculates the dependent control matrices from the independent control
         matrix CC_i_solution
@@ -358,7 +1033,7 @@ class SymcaToolBox(object):
 
         cc_sol = tempmatrix
 
-        cc_sol = SymcaToolBox.maxima_factor(cc_sol,path_to)
+        cc_sol = SymcaToolBox.factor(cc_sol, path_to, workers, backend)
 
         #print len(j_cci_sol)
         #print len(j_ccd_sol)
@@ -367,6 +1042,74 @@ class SymcaToolBox(object):
 
         return cc_sol
 
+    @staticmethod
+    def dep_row(row, scaledk0, scaledl0, num_ind_fluxes):
+        """
+        Returns the rows of the independent control matrix cc_i_num (see
+        solve_dep) that the given row of the control matrix is made of,
+        as a list of (cc_i_num row, coefficient).
+        """
+        num_dep_fluxes = scaledk0.rows
+        num_ind_species = scaledl0.cols
+        if row < num_ind_fluxes:
+            return [(row, 1)]
+        row -= num_ind_fluxes
+        if row < num_dep_fluxes:
+            return [(k, scaledk0[row, k]) for k in range(scaledk0.cols)
+                    if scaledk0[row, k] != 0]
+        row -= num_dep_fluxes
+        if row < num_ind_species:
+            return [(num_ind_fluxes + row, 1)]
+        row -= num_ind_species
+        return [(num_ind_fluxes + s, scaledl0[row, s])
+                for s in range(num_ind_species) if scaledl0[row, s] != 0]
+
+    @staticmethod
+    def control_matrix_zeros(matrix, scaledk0, scaledl0, num_ind_fluxes):
+        """
+        Returns the set of (flat) indices of the elements of the control
+        matrix (see solve_dep) that are structurally zero: those for
+        which every element of the adjugate of matrix (the ematrix) that
+        they are made of (see dep_row) is structurally zero (see
+        adjugate_zeros). Returns None if the matrix is structurally
+        singular.
+        """
+        adjugate_zeros = SymcaToolBox.adjugate_zeros(matrix)
+        if adjugate_zeros is None:
+            return None
+        n = matrix.cols
+        num_rows = n + scaledk0.rows + scaledl0.rows
+        zeros = set()
+        for row in range(num_rows):
+            parts = SymcaToolBox.dep_row(
+                row,
+                scaledk0,
+                scaledl0,
+                num_ind_fluxes
+            )
+            for j in range(n):
+                if all((r, j) in adjugate_zeros for r, coefficient in parts):
+                    zeros.add(row * n + j)
+        return zeros
+
+    @staticmethod
+    def iter_dep(cc_i_num, scaledk0, scaledl0, num_ind_fluxes):
+        """
+        Yields the (unfactored) elements of the control matrix calculated
+        by solve_dep one at a time and in the same order. The dependent
+        rows are only calculated when they are reached.
+        """
+        j_cci_sol = cc_i_num[:num_ind_fluxes, :]
+        s_cci_sol = cc_i_num[num_ind_fluxes:, :]
+
+        for independent, scaled in [(j_cci_sol, scaledk0),
+                                    (s_cci_sol, scaledl0)]:
+            for each in independent:
+                yield each
+            for row in range(scaled.rows):
+                for each in scaled[row, :] * independent:
+                    yield each
+
     @staticmethod
     def build_cc_matrix(j, jind, sind, jdep, sdep):
         """
@@ -454,18 +1197,51 @@ class SymcaToolBox(object):
         new_cc_num = cc_num[:, :]
         #print type(new_cc_num)
         for i, each in enumerate(new_cc_num):
-            new_cc_num[i] = ((each * cd_denom) / fix_denom).expand()
+            new_cc_num[i] = SymcaToolBox.fix_expression(
+                each,
+                cd_denom,
+                fix_denom
+            )
 
         return new_cc_num, (cd_num / fix_denom).expand()
 
+    @staticmethod
+    def fix_expression(cc_num, cd_denom, fix_denom):
+        """
+        Fixes a single control coefficient numerator (see
+        fix_expressions). cd_denom is the denominator of the common
+        denominator expression and fix_denom is given by get_fix_denom.
+        """
+        return ((cc_num * cd_denom) / fix_denom).expand()
 
     @staticmethod
-    def spawn_cc_objects(mod, cc_sol, cc_names, common_denom_expr):
+    def get_symbols(*expressions):
+        """
+        Returns the symbols in expressions (expressions or matrices)
+        sorted by name. All CC objects are compiled with the same ordered
+        symbols.
+        """
+        symbols = set()
+        for expression in expressions:
+            symbols.update(expression.atoms(Symbol))
+        return sorted(symbols, key=str)
+
+    @staticmethod
+    def spawn_cc_objects(mod, cc_sol, cc_names, common_denom_expr,
+                         values=None):
+
+        # all CC objects are compiled with the same ordered symbols and
+        # read their values through the same ModelValues object
+        symbols = SymcaToolBox.get_symbols(common_denom_expr, cc_sol)
+        if values is None:
+            values = ModelValues(mod)
 
         common_denom = CCBase(
             mod,
             'common_denominator',
-            common_denom_expr
+            common_denom_expr,
+            symbols,
+            values
         )
 
         cc_object_list = [common_denom]
@@ -476,10 +1252,16 @@ class SymcaToolBox(object):
                     mod,
                     str(each),
                     cc_sol[i],
-                    common_denom
+                    common_denom,
+                    symbols,
+                    values
                 )
             )
 
+        evaluator = CCEvaluator(symbols, common_denom, cc_object_list[1:])
+        for cc in cc_object_list[1:]:
+            cc.evaluator = evaluator
+
         return cc_object_list
 
     # @staticmethod
@@ -515,6 +1297,6 @@ class SymcaToolBox(object):
 
     #     return expr
 
-    
 
-            
+SymcaToolBox.register_backend('maxima', SymcaToolBox._maxima_factor_element)
+SymcaToolBox.register_backend('sympy', SymcaToolBox._sympy_factor_element)
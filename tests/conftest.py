@@ -0,0 +1,144 @@
+import sys
+import random
+from os import path
+
+import numpy as np
+import pytest
+from sympy import Symbol, Integer, expand, fraction, together
+from sympy.matrices import Matrix
+
+# the modules of symca are imported from the repository root
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from NumpyModel import NumpyModel
+from Symca import Symca
+from SymcaBenchmark import SymcaBenchmark
+
+
+def sparse_matrix(rng, n, density=0.35, diagonal=True, name='x'):
+    """
+    Returns a random n x n sympy matrix in which roughly a fraction
+    density of the elements (and, if diagonal is True, every diagonal
+    element) is nonzero, like an ematrix: most nonzero elements are
+    distinct symbols, some are small integers or ratios of symbols
+    (as in the scaled K and L matrices). The symbols are name1, name2,
+    ...
+    """
+    count = [0]
+
+    def element():
+        count[0] += 1
+        symbol = Symbol('%s%d' % (name, count[0]))
+        kind = rng.random()
+        if kind < 0.15:
+            return Integer(rng.choice([-2, -1, 1, 3]))
+        if kind < 0.3:
+            return symbol / Symbol('y%d' % rng.randint(1, 3))
+        return symbol
+
+    return Matrix(n, n, lambda i, j: element()
+                  if (diagonal and i == j) or rng.random() < density else 0)
+
+
+def same(a, b):
+    """True if the expressions (or matrices) a and b are equal"""
+    if getattr(a, 'is_Matrix', False):
+        return a.shape == b.shape and all(
+            same(x, y) for x, y in zip(a, b)
+        )
+    # cancel() does not always expand a numerator that is zero
+    return expand(fraction(together(a - b))[0]) == 0
+
+
+@pytest.fixture(scope='session')
+def sparse_matrices():
+    """A list of (matrix, adjugate, determinant) of random sparse
+    symbolic matrices of size 1 to 5, with the adjugate and determinant
+    calculated by sympy"""
+    rng = random.Random(1)
+    matrices = [sparse_matrix(rng, n) for n in (1, 2, 3, 4, 5)
+                for i in range(3)]
+    return [(m, m.adjugate(), m.det()) for m in matrices]
+
+
+def random_model(rng, kind, size, directory, feedback=None):
+    """network(kind, size) as a NumpyModel with random elasticities,
+    fluxes and concentrations. If feedback is True the first reaction
+    also has an elasticity towards the last species. By default only
+    moiety networks have no feedback, as it makes their expressions too
+    large for a quick test with the sympy backend."""
+    reactions, fixed = SymcaBenchmark.network(kind, size)
+    elasticities = {}
+    species = set()
+    for name, substrates, products in reactions:
+        for each in substrates:
+            if each not in fixed:
+                elasticities['ec%s_%s' % (name, each)] = rng.uniform(0.2, 2)
+                species.add(each)
+        for each in products:
+            if each not in fixed:
+                elasticities['ec%s_%s' % (name, each)] = -rng.uniform(0.1, 1)
+                species.add(each)
+    if feedback is None:
+        feedback = kind != 'moiety'
+    if feedback:
+        elasticities['ec%s_%s' % (reactions[0][0], max(species))] = (
+            -rng.uniform(0.1, 1)
+        )
+    return NumpyModel(
+        reactions,
+        fixed,
+        elasticities=elasticities,
+        fluxes=dict((name, rng.uniform(0.5, 5))
+                    for name, substrates, products in reactions),
+        concentrations=dict((each, rng.uniform(0.1, 10))
+                            for each in sorted(species)),
+        name='%s_%d' % (kind, size),
+        directory=directory
+    )
+
+
+def make_symca(mod, **options):
+    """A Symca object that uses the sympy backend and neither the cache
+    nor checkpoints unless options say otherwise"""
+    options.setdefault('backend', 'sympy')
+    options.setdefault('cache', False)
+    options.setdefault('checkpoint', False)
+    return Symca(mod, **options)
+
+
+@pytest.fixture(scope='module')
+def solved(tmpdir_factory):
+    """solved(kind, size) returns a Symca object on which do_symca has
+    been called for a random_model, shared by the tests of a module
+    (which must not change the model)"""
+    symca_objects = {}
+
+    def solve(kind, size):
+        if (kind, size) not in symca_objects:
+            directory = str(tmpdir_factory.mktemp(kind))
+            mod = random_model(random.Random(size), kind, size, directory)
+            sc = make_symca(mod)
+            sc.do_symca()
+            symca_objects[kind, size] = sc
+        return symca_objects[kind, size]
+    return solve
+
+
+@pytest.fixture
+def scanned(tmpdir):
+    """A solved Symca object of a model whose elasticities and fluxes
+    depend on the parameter p (1 at first)"""
+    mod = random_model(random.Random(2), 'branched', 3, str(tmpdir))
+    mod.p = 1.0
+    elasticities = mod.elas_var.copy()
+    powers = np.random.RandomState(2).uniform(-1, 1, elasticities.shape)
+
+    def update(model):
+        model.elas_var = elasticities * model.p ** powers
+        model.set_fluxes({'R1': 1 + model.p})
+
+    mod.update = update
+    sc = make_symca(mod)
+    sc.do_symca()
+    return sc
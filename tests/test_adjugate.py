@@ -0,0 +1,66 @@
+import random
+
+from sympy.matrices import Matrix, zeros
+
+from conftest import sparse_matrix, same
+from SymcaToolBox import SymcaToolBox as SMCAtools
+
+
+def test_adjugate_bareiss(sparse_matrices):
+    for matrix, adjugate, det in sparse_matrices:
+        result = SMCAtools.adjugate_bareiss(matrix)
+        if same(det, 0):
+            assert result is None
+        else:
+            assert same(result, adjugate)
+
+
+def test_adjugate_bareiss_columns(sparse_matrices):
+    for matrix, adjugate, det in sparse_matrices:
+        if same(det, 0):
+            continue
+        columns = [j for j in range(matrix.cols) if j % 2 == 0][::-1]
+        result = SMCAtools.adjugate_bareiss(matrix, columns)
+        assert same(result, adjugate.extract(range(matrix.rows), columns))
+
+
+def test_adjugate_bareiss_row_swaps():
+    x, y = Matrix([['x', 'y']])
+    matrix = Matrix([[0, x, 1], [y, 0, 0], [1, 1, 0]])
+    assert same(SMCAtools.adjugate_bareiss(matrix), matrix.adjugate())
+
+
+def test_adjugate_minors(sparse_matrices):
+    for matrix, adjugate, det in sparse_matrices:
+        assert same(SMCAtools.adjugate_minors(matrix), adjugate)
+
+
+def test_adjugate_matrix_methods_agree(sparse_matrices):
+    for matrix, adjugate, det in sparse_matrices:
+        for method in ('bareiss', 'minors'):
+            assert same(SMCAtools.adjugate_matrix(matrix, method), adjugate)
+
+
+def test_adjugate_matrix_singular():
+    # structurally nonsingular but singular: bareiss falls back to minors
+    matrix = Matrix([[1, 1, 0], [1, 1, 0], [0, 0, 'x']])
+    assert SMCAtools.adjugate_bareiss(matrix) is None
+    adjugate = SMCAtools.adjugate_matrix(matrix, 'bareiss')
+    assert same(adjugate, matrix.adjugate())
+    assert adjugate * matrix == zeros(3, 3)
+
+
+def test_adjugate_rows(sparse_matrices):
+    rng = random.Random(2)
+    for matrix, adjugate, det in sparse_matrices:
+        rows = rng.sample(range(matrix.rows), rng.randint(1, matrix.rows))
+        expected = adjugate.extract(rows, range(matrix.cols))
+        for method in ('bareiss', 'minors'):
+            assert same(SMCAtools.adjugate_rows(matrix, rows, method),
+                        expected)
+
+
+def test_adjugate_larger_sparse():
+    rng = random.Random(3)
+    matrix = sparse_matrix(rng, 7, density=0.2)
+    assert same(SMCAtools.adjugate_matrix(matrix), matrix.adjugate())
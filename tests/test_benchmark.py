@@ -0,0 +1,37 @@
+import json
+import os
+import tempfile
+
+from SymcaBenchmark import SymcaBenchmark
+
+
+def test_run_suite(tmpdir, monkeypatch):
+    work = tmpdir.mkdir('work')
+    monkeypatch.setattr(tempfile, 'tempdir', str(work))
+    output_file = str(tmpdir.join('suite.json'))
+    results = SymcaBenchmark.run_suite(output_file, ['linear', 'branched'],
+                                       (3,), backend='sympy',
+                                       checkpoint=False)
+    assert json.load(open(output_file))['runs'] == results['runs']
+    for run in results['runs']:
+        assert sorted(run['stages']) == [
+            'adjugate_matrix', 'det_polynomial', 'ematrix',
+            'fix_expressions', 'maxima_factor', 'solve_dep',
+            'spawn_cc_objects'
+        ]
+    # the working directories of the networks are removed
+    assert os.listdir(str(work)) == []
+
+
+def test_run_suite_failed_stage(tmpdir, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir))
+    results = SymcaBenchmark.run_suite(
+        str(tmpdir.join('suite.json')), ['linear'], (3,),
+        backend='no_such_backend', det_method='bareiss', checkpoint=False
+    )
+    stages = results['runs'][0]['stages']
+    assert 'output_size' in stages['det_bareiss']
+    assert 'ValueError' in stages['maxima_factor']['failed']
+    assert stages['fix_expressions'] == {
+        'skipped': 'needs solve_dep, maxima_factor'
+    }
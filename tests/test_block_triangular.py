@@ -0,0 +1,105 @@
+import random
+
+import pytest
+from sympy.matrices import Matrix, zeros
+
+from conftest import sparse_matrix, same
+from SymcaToolBox import SymcaToolBox as SMCAtools
+
+
+def block_triangular_matrix(rng, sizes):
+    """A random matrix that is upper block triangular with diagonal
+    blocks of the given sizes once its rows and columns are permuted.
+    Returns the matrix and the number of diagonal blocks"""
+    n = sum(sizes)
+    matrix = zeros(n, n)
+    start = 0
+    for b, size in enumerate(sizes):
+        block = sparse_matrix(rng, size, density=0.6, name='d%d_' % b)
+        matrix[start:start + size, start:start + size] = block
+        for j in range(start + size, n):
+            for i in range(start, start + size):
+                if rng.random() < 0.3:
+                    matrix[i, j] = sparse_matrix(
+                        rng, 1, name='u%d_%d_' % (i, j)
+                    )[0, 0]
+        start += size
+    rows = list(range(n))
+    cols = list(range(n))
+    rng.shuffle(rows)
+    rng.shuffle(cols)
+    return matrix.extract(rows, cols)
+
+
+@pytest.fixture(scope='module')
+def reducible_matrices():
+    rng = random.Random(4)
+    return [block_triangular_matrix(rng, sizes)
+            for sizes in ([1, 1], [2, 1], [1, 3], [2, 2, 1], [1, 2, 1, 2])]
+
+
+def check_form(matrix, btf):
+    rows, cols, blocks = btf
+    n = matrix.rows
+    assert sorted(rows) == list(range(n))
+    assert sorted(cols) == list(range(n))
+    assert blocks[0][0] == 0 and blocks[-1][1] == n
+    for (s1, e1), (s2, e2) in zip(blocks[:-1], blocks[1:]):
+        assert e1 == s2 and s1 < e1
+    t = matrix.extract(rows, cols)
+    for b, (start, end) in enumerate(blocks):
+        # nothing left of a diagonal block
+        assert all(e == 0 for e in t[start:end, :start])
+        # and its diagonal is zero free
+        assert all(t[i, i] != 0 for i in range(start, end))
+
+
+def test_block_triangular_form(reducible_matrices):
+    for matrix in reducible_matrices:
+        btf = SMCAtools.block_triangular_form(matrix)
+        check_form(matrix, btf)
+        assert len(btf[2]) > 1
+
+
+def test_block_triangular_form_random(sparse_matrices):
+    for matrix, adjugate, det in sparse_matrices:
+        btf = SMCAtools.block_triangular_form(matrix)
+        check_form(matrix, btf)
+
+
+def test_block_triangular_form_structurally_singular():
+    matrix = Matrix([[1, 'x', 0], [0, 0, 0], ['y', 0, 1]])
+    assert SMCAtools.block_triangular_form(matrix) is None
+
+
+@pytest.mark.parametrize('det_method', ['polynomial', 'bareiss'])
+@pytest.mark.parametrize('adjugate_method', ['bareiss', 'minors'])
+def test_invert_block_triangular(reducible_matrices, tmpdir, det_method,
+                                 adjugate_method):
+    for matrix in reducible_matrices:
+        btf = SMCAtools.block_triangular_form(matrix)
+        adjugate, common_denom = SMCAtools.invert_block_triangular(
+            matrix,
+            btf,
+            str(tmpdir) + '/',
+            adjugate_method,
+            'sympy',
+            det_method
+        )
+        assert same(adjugate, matrix.adjugate())
+        assert same(common_denom, matrix.det())
+
+
+def test_invert_block_decompose_agrees(sparse_matrices, tmpdir):
+    for matrix, adjugate, det in sparse_matrices:
+        if same(det, 0):
+            continue
+        for block_decompose in (True, False):
+            result, common_denom = SMCAtools.invert(
+                matrix,
+                str(tmpdir) + '/',
+                block_decompose=block_decompose,
+                backend='sympy'
+            )
+            assert same(result, adjugate)
+            assert same(common_denom, det)
@@ -0,0 +1,79 @@
+import random
+import time
+from os import path, utime
+
+from conftest import random_model, make_symca
+from SymcaCache import SymcaCache
+
+
+def stage_names(sc):
+    return [stage['name'] for stage in sc.profile['stages']]
+
+
+def test_cache_hit_and_miss(tmpdir):
+    directory = str(tmpdir)
+    first = make_symca(random_model(random.Random(1), 'branched', 3,
+                                    directory), cache=True)
+    first.do_symca()
+    assert 'invert' in stage_names(first)
+
+    # other values, same structure: served from the cache
+    mod = random_model(random.Random(2), 'branched', 3, directory)
+    second = make_symca(mod, cache=True)
+    second.do_symca()
+    assert 'invert' not in stage_names(second)
+    assert second.cache_key() == first.cache_key()
+    assert second.check_cc() == []
+
+    # another option misses it
+    other = make_symca(mod, cache=True, det_method='bareiss')
+    other.do_symca()
+    assert 'invert' in stage_names(other)
+    assert other.cache_key() != first.cache_key()
+    assert other.check_cc() == []
+
+
+def test_cache_key_structure(tmpdir):
+    mod = random_model(random.Random(1), 'branched', 3, str(tmpdir))
+    sc = make_symca(mod)
+    mod.doMca()
+    sc.refresh()
+    key = sc.cache_key()
+    mod.elas_var = mod.elas_var * 2
+    mod.doMca()
+    sc.refresh()
+    assert sc.cache_key() == key
+    # a zero elasticity changes the structure
+    mod.ecR1_S1 = 0
+    mod.doMca()
+    sc.refresh()
+    assert sc.cache_key() != key
+
+
+def test_no_cache_directory(tmpdir):
+    mod = random_model(random.Random(1), 'linear', 3, str(tmpdir))
+    sc = make_symca(mod, cache=False)
+    sc.do_symca()
+    assert not path.exists(path.join(sc.path_to(''), 'cache'))
+
+
+def test_eviction(tmpdir):
+    cache = SymcaCache(str(tmpdir), max_size=2 ** 20)
+    result = 'x' * 1000
+    cache.put('a', result)
+    cache.put('b', result)
+    size = path.getsize(cache._file_name('a'))
+
+    now = time.time()
+    utime(cache._file_name('a'), (now - 200, now - 200))
+    utime(cache._file_name('b'), (now - 100, now - 100))
+    # marks a as the most recently used result
+    assert cache.get('a') == result
+    assert path.getmtime(cache._file_name('a')) > now - 100
+
+    cache.max_size = 2 * size
+    cache.put('c', result)
+    assert cache.get('b') is None
+    assert cache.get('a') == result
+    assert cache.get('c') == result
+    assert cache.get('missing') is None
@@ -0,0 +1,95 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from CCobjects import CCBase, CCoef
+
+
+def largest_cc(sc):
+    return max(sc.CC, key=lambda cc: cc.pattern_count)
+
+
+def test_ccoef_without_evaluator(scanned):
+    mod = scanned.mod
+    cc = largest_cc(scanned)
+    denominator = CCBase(mod, 'd', scanned.common_denominator.expression)
+    alone = CCoef(mod, cc.name, cc.numerator, denominator)
+    assert alone.evaluator is None
+    assert np.isclose(alone.value, cc.value)
+    assert np.allclose(alone.percentages, cc.percentages)
+
+    scan_range = [0.5, 1.0, 2.0]
+    result = alone.parscan('p', scan_range, init_return=True)
+    assert np.allclose(result,
+                       cc.parscan('p', scan_range, init_return=True))
+    assert not np.allclose(result[0, 1:], result[-1, 1:])
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_parscan_empty(scanned, workers):
+    cc = largest_cc(scanned)
+    result = cc.parscan('p', [], workers=workers)
+    assert result.shape == (0, cc.pattern_count + 1)
+
+
+def test_parscan_workers(scanned):
+    mod = scanned.mod
+    cc = largest_cc(scanned)
+    scan_range = np.linspace(0.5, 2, 7)
+    elasticities = mod.elas_var
+    parallel = cc.parscan('p', scan_range, workers=2)
+    # the workers scan their own copies of the model
+    assert mod.p == 1.0
+    assert mod.elas_var is elasticities
+    assert multiprocessing.active_children() == []
+
+    serial = cc.parscan('p', scan_range)
+    assert np.allclose(parallel, serial)
+    assert parallel.shape == (len(scan_range), cc.pattern_count + 1)
+
+
+@pytest.mark.parametrize('init_return', [False, True])
+def test_parscan_init_return(scanned, init_return):
+    cc = largest_cc(scanned)
+    cc.parscan('p', [0.5, 2.0], init_return=init_return)
+    assert scanned.mod.p == (1.0 if init_return else 2.0)
+
+
+def ranked(cc, k):
+    """The indices of the k largest control patterns of cc by brute
+    force"""
+    patterns = cc.control_patterns
+    values = np.abs([pattern.value for pattern in patterns])
+    return list(np.argsort(-values, kind='mergesort')[:k])
+
+
+@pytest.mark.parametrize('k', [0, 1, 3])
+def test_top_patterns(scanned, k):
+    mod = scanned.mod
+    for p in [1.0, 1.5, 0.2, 4.0]:
+        mod.p = p
+        mod.doMca()
+        for cc in scanned.CC:
+            top = [pattern.index for pattern in cc.top_patterns(k)]
+            assert top == ranked(cc, k)
+
+
+@pytest.mark.parametrize('evaluator', [True, False])
+def test_top_parscan(scanned, evaluator):
+    mod = scanned.mod
+    cc = largest_cc(scanned)
+    if not evaluator:
+        denominator = CCBase(mod, 'd', scanned.common_denominator.expression)
+        cc = CCoef(mod, cc.name, cc.numerator, denominator)
+    scan_range = [0.5, 1.0, 2.0]
+    for k in [0, 2]:
+        patterns, result = cc.top_parscan('p', scan_range, k,
+                                          init_return=True)
+        indices = [pattern.index for pattern in patterns]
+        assert indices == ranked(cc, k)
+        expected = cc.parscan('p', scan_range, init_return=True)
+        assert result.shape == (len(scan_range), k + 1)
+        assert np.allclose(result[:, 0], scan_range)
+        assert np.allclose(result[:, 1:],
+                           expected[:, [i + 1 for i in indices]])
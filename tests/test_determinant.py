@@ -0,0 +1,51 @@
+import random
+
+import pytest
+from sympy import Rational, Symbol
+from sympy.matrices import Matrix
+
+from conftest import sparse_matrix, same
+from SymcaToolBox import SymcaToolBox as SMCAtools
+
+
+@pytest.mark.parametrize('function', [
+    SMCAtools.det_bareis,
+    SMCAtools.det_bareis_poly,
+])
+def test_determinant(sparse_matrices, function):
+    for matrix, adjugate, det in sparse_matrices:
+        assert same(function(matrix), det)
+
+
+@pytest.mark.parametrize('method', ['polynomial', 'bareiss'])
+def test_determinant_methods(sparse_matrices, method):
+    for matrix, adjugate, det in sparse_matrices:
+        assert same(SMCAtools.determinant(matrix, method), det)
+
+
+def test_det_bareis_poly_rational_rows():
+    # rows with different denominators are scaled by different lcms
+    x, y, z = [Symbol(each) for each in 'xyz']
+    matrix = Matrix([
+        [x / y, Rational(1, 2), 0],
+        [1, z / (x * y), -y / z],
+        [Rational(-3, 4) * z, 0, x + y],
+    ])
+    assert same(SMCAtools.det_bareis_poly(matrix), matrix.det())
+
+
+def test_det_bareis_poly_numbers():
+    matrix = Matrix([[2, Rational(1, 3)], [4, 5]])
+    assert SMCAtools.det_bareis_poly(matrix) == matrix.det()
+
+
+def test_det_bareis_poly_singular():
+    x = Symbol('x')
+    matrix = Matrix([[x, 0, 1], [0, 0, 'y'], [2 * x, 0, 2]])
+    assert SMCAtools.det_bareis_poly(matrix) == 0
+
+
+def test_det_bareis_poly_larger_sparse():
+    rng = random.Random(5)
+    matrix = sparse_matrix(rng, 8, density=0.2)
+    assert same(SMCAtools.det_bareis_poly(matrix), matrix.det())
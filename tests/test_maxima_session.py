@@ -0,0 +1,145 @@
+import os
+import stat
+import sys
+import time
+
+import pytest
+
+from MaximaSession import (MaximaSession, MaximaPool, MaximaError,
+                           MaximaTimeoutError, MaximaInputError)
+
+
+# Answers the statements written by MaximaSession.factor like maxima
+# would. The expression decides what happens: 'fail' makes factor fail,
+# 'syntax' and 'ask' stop with a syntax error or a question, 'sleep'
+# never answers, 'crash' exits and 'crash_once' only exits the first
+# time (remembered in the file $FAKE_MAXIMA_CRASHED). Every other
+# expression x is answered with factored(x).
+FAKE_MAXIMA = r'''#!%s
+import os
+import re
+import sys
+import time
+
+statement = re.compile(r'factor\((.*)\)\)\)\$ print\("(\w+)"\)\$ '
+                       r'if .* then print\("(\w+)"\) .* print\("(\w+)"\)\$$')
+
+
+def write(*lines):
+    for line in lines:
+        sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+
+for line in iter(sys.stdin.readline, ''):
+    line = line.strip()
+    if line.startswith('quit()'):
+        break
+    match = statement.search(line)
+    if not match:
+        continue
+    expression, begin, fail, end = match.groups()
+    crashed = os.environ.get('FAKE_MAXIMA_CRASHED')
+    if expression == 'crash_once' and not os.path.exists(crashed):
+        open(crashed, 'w').close()
+        expression = 'crash'
+    if expression == 'crash':
+        sys.exit(1)
+    elif expression == 'sleep':
+        time.sleep(60)
+    elif expression == 'syntax':
+        write('incorrect syntax: syntax is not an infix operator',
+              '(%%i2) ')
+    elif expression == 'ask':
+        write('Is  a  positive, negative or zero?')
+    elif expression == 'fail':
+        write(begin, fail, end)
+    else:
+        write(begin, 'factored(' + expression + ')', end)
+'''
+
+
+@pytest.fixture
+def fake_maxima(tmpdir, monkeypatch):
+    """Puts a fake maxima (see FAKE_MAXIMA) first on PATH"""
+    script = tmpdir.join('maxima')
+    script.write(FAKE_MAXIMA % sys.executable)
+    script.chmod(script.stat().mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', str(tmpdir) + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('FAKE_MAXIMA_CRASHED', str(tmpdir.join('crashed')))
+    return script
+
+
+def test_factor(fake_maxima):
+    session = MaximaSession(timeout=10)
+    try:
+        assert session.factor('x*y+x') == 'factored(x*y+x)'
+        pid = session._process.pid
+        assert session.factor('a-b') == 'factored(a-b)'
+        # one process for all expressions
+        assert session._process.pid == pid
+    finally:
+        session.close()
+    assert not session.is_alive
+
+
+def test_factor_error(fake_maxima):
+    session = MaximaSession(timeout=10)
+    try:
+        with pytest.raises(MaximaError) as error:
+            session.factor('fail')
+        assert type(error.value) is MaximaError
+        # maxima caught the error itself, the process can be used again
+        assert session.is_alive
+        assert session.factor('x') == 'factored(x)'
+    finally:
+        session.close()
+
+
+@pytest.mark.parametrize('expression', ['syntax', 'ask'])
+def test_rejected_input(fake_maxima, expression):
+    session = MaximaSession(timeout=10)
+    try:
+        start = time.time()
+        with pytest.raises(MaximaInputError):
+            session.factor(expression)
+        # detected at once instead of after the timeout
+        assert time.time() - start < 5
+        assert not session.is_alive
+        assert session.factor('x') == 'factored(x)'
+    finally:
+        session.close()
+
+
+def test_timeout(fake_maxima):
+    session = MaximaSession(timeout=0.5)
+    try:
+        with pytest.raises(MaximaTimeoutError):
+            session.factor('sleep')
+        assert not session.is_alive
+        assert session.factor('x') == 'factored(x)'
+    finally:
+        session.close()
+
+
+def test_crash(fake_maxima):
+    session = MaximaSession(timeout=10)
+    try:
+        with pytest.raises(MaximaError):
+            session.factor('crash')
+        assert not session.is_alive
+        # restarted on the next call
+        assert session.factor('x') == 'factored(x)'
+    finally:
+        session.close()
+
+
+def test_pool_restarts_after_crash(fake_maxima):
+    pool = MaximaPool(size=2, timeout=10)
+    try:
+        assert pool.factor('crash_once') == 'factored(crash_once)'
+        with pytest.raises(MaximaInputError):
+            pool.factor('syntax')
+        assert pool.factor('x') == 'factored(x)'
+    finally:
+        pool.close()
@@ -0,0 +1,34 @@
+import random
+
+import numpy as np
+
+from conftest import random_model
+from ModelValues import ModelValues
+
+
+class AttributeModel(object):
+    """A model without value arrays"""
+
+    def __init__(self, mod):
+        for reaction in mod.reactions:
+            for each in mod.species:
+                name = 'ec%s_%s' % (reaction, each)
+                setattr(self, name, getattr(mod, name))
+
+
+def test_elasticities(tmpdir):
+    mod = random_model(random.Random(1), 'branched', 4, str(tmpdir))
+    reactions = list(mod.reactions)[::-1]
+    species = list(mod.species)[1:] + list(mod.species)[:1]
+    expected = np.array([[getattr(mod, 'ec%s_%s' % (reaction, each))
+                          for each in species]
+                         for reaction in reactions])
+
+    values = ModelValues(mod)
+    assert np.array_equal(values.elasticities(reactions, species), expected)
+    # taken from elas_var without the map of all symbol names
+    assert values._index is None
+
+    without_arrays = ModelValues(AttributeModel(mod))
+    assert np.array_equal(without_arrays.elasticities(reactions, species),
+                          expected)
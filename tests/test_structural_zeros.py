@@ -0,0 +1,116 @@
+import random
+
+import pytest
+from sympy import Symbol, Integer
+from sympy.matrices import Matrix
+
+from conftest import same
+from SymcaToolBox import SymcaToolBox as SMCAtools
+
+
+def generic_matrix(rng, n, density=0.35, diagonal=True):
+    """A random sparse n x n matrix whose nonzero elements are distinct
+    symbols, so that an element of its adjugate is only zero if it is
+    structurally zero"""
+    return Matrix(n, n, lambda i, j: Symbol('a%d_%d' % (i, j))
+                  if (diagonal and i == j) or rng.random() < density else 0)
+
+
+def zero_indices(matrix):
+    return set((i, j) for i in range(matrix.rows)
+               for j in range(matrix.cols) if same(matrix[i, j], 0))
+
+
+@pytest.fixture(scope='module')
+def generic_matrices():
+    """(matrix, adjugate, determinant) of random generic matrices, some
+    of them without a full diagonal (and so possibly singular)"""
+    rng = random.Random(7)
+    matrices = [generic_matrix(rng, n, diagonal=diagonal)
+                for n in (1, 2, 3, 4, 5)
+                for diagonal in (True, False)
+                for i in range(3)]
+    return [(m, m.adjugate(), m.det()) for m in matrices]
+
+
+def test_adjugate_zeros(generic_matrices):
+    checked = 0
+    found = 0
+    for matrix, adjugate, det in generic_matrices:
+        zeros = SMCAtools.adjugate_zeros(matrix)
+        if zeros is None:
+            continue
+        assert zeros == zero_indices(adjugate), matrix
+        checked += 1
+        found += len(zeros)
+    assert checked > len(generic_matrices) // 2
+    assert found > 0
+
+
+def test_adjugate_zeros_singular(generic_matrices):
+    singular = 0
+    for matrix, adjugate, det in generic_matrices:
+        if SMCAtools.adjugate_zeros(matrix) is None:
+            assert same(det, 0), matrix
+            singular += 1
+        else:
+            assert not same(det, 0), matrix
+    assert singular > 0
+
+
+def test_adjugate_zeros_structurally_singular():
+    a, b, c = Symbol('a'), Symbol('b'), Symbol('c')
+    # two rows that only have an element in the same column
+    matrix = Matrix([[a, 0, 0], [b, 0, 0], [0, c, a]])
+    assert SMCAtools.adjugate_zeros(matrix) is None
+    assert SMCAtools.adjugate_zeros(Matrix([[a, 0], [b, 0]])) is None
+
+
+def test_adjugate_zeros_diagonal():
+    a, b, c = Symbol('a'), Symbol('b'), Symbol('c')
+    matrix = Matrix([[a, 0, 0], [0, b, 0], [0, 0, c]])
+    zeros = set((i, j) for i in range(3) for j in range(3) if i != j)
+    assert SMCAtools.adjugate_zeros(matrix) == zeros
+
+
+def test_adjugate_zeros_not_generic(sparse_matrices):
+    # with repeated symbols and numbers more elements can be zero, but
+    # the structural zeros must always be zero
+    for matrix, adjugate, det in sparse_matrices:
+        zeros = SMCAtools.adjugate_zeros(matrix)
+        if zeros is not None:
+            assert zeros <= zero_indices(adjugate), matrix
+
+
+def test_control_matrix_zeros():
+    rng = random.Random(11)
+    found = 0
+    for n, num_ind_fluxes in [(3, 1), (4, 2), (4, 3), (5, 2), (5, 3)]:
+        for i in range(3):
+            matrix = generic_matrix(rng, n, density=0.25)
+            num_ind_species = n - num_ind_fluxes
+            scaled_k0 = Matrix(
+                rng.randint(1, 2), num_ind_fluxes,
+                lambda r, c: Integer(rng.choice([0, 0, -1, 1, 2]))
+            )
+            scaled_l0 = Matrix(
+                rng.randint(0, 2), num_ind_species,
+                lambda r, c: Integer(rng.choice([0, 0, -1, 1, 2]))
+            )
+            elements = list(SMCAtools.iter_dep(
+                matrix.adjugate(),
+                scaled_k0,
+                scaled_l0,
+                num_ind_fluxes
+            ))
+            expected = set(index for index, element in enumerate(elements)
+                           if same(element, 0))
+            zeros = SMCAtools.control_matrix_zeros(
+                matrix,
+                scaled_k0,
+                scaled_l0,
+                num_ind_fluxes
+            )
+            assert zeros == expected, (matrix, scaled_k0, scaled_l0)
+            found += len(zeros)
+    assert found > 0
@@ -0,0 +1,253 @@
+import random
+from os import path
+
+import numpy as np
+import pytest
+from sympy import Symbol
+
+from conftest import random_model, make_symca
+from SymcaBenchmark import SymcaBenchmark
+from SymcaCheckpoint import SymcaCheckpoint
+from SymcaToolBox import SymcaToolBox as SMCAtools
+
+
+@pytest.mark.parametrize('kind, size', [
+    ('linear', 3), ('linear', 4), ('branched', 3), ('branched', 4),
+    ('cycle', 3), ('moiety', 3),
+])
+def test_do_symca(kind, size, tmpdir):
+    mod = random_model(random.Random(size), kind, size, str(tmpdir))
+    sc = make_symca(mod)
+    sc.do_symca()
+    assert sc.check_cc() == []
+
+    # new values, same structure
+    rng = np.random.RandomState(size)
+    mod.elas_var = mod.elas_var * rng.uniform(0.5, 2, mod.elas_var.shape)
+    mod.state_species = mod.state_species * 2
+    mod.doMca()
+    assert sc.check_cc() == []
+
+    mod.cc_all = -mod.cc_all
+    assert sc.check_cc() != []
+
+
+@pytest.mark.parametrize('options', [
+    {'block_decompose': False},
+    {'adjugate_method': 'minors'},
+    {'det_method': 'bareiss'},
+])
+@pytest.mark.parametrize('kind', ['branched', 'moiety'])
+def test_options_agree(kind, options, solved):
+    reference = solved(kind, 3)
+    sc = make_symca(reference.mod, **options)
+    sc.do_symca()
+    assert np.allclose(sc.cc_matrix(), reference.cc_matrix())
+    assert sc.check_cc() == []
+
+
+@pytest.mark.parametrize('kind', ['cycle', 'moiety'])
+def test_iter_symca(kind, solved):
+    reference = solved(kind, 3)
+    sc = make_symca(reference.mod)
+    names = [cc.name for cc in sc.iter_symca()]
+    assert names == [cc.name for cc in reference.CC]
+    assert np.allclose(sc.cc_matrix(), reference.cc_matrix())
+    assert sc.check_cc() == []
+
+
+def test_targeted(solved):
+    reference = solved('moiety', 3)
+    names = [cc.name for cc in reference.CC][::3]
+    sc = make_symca(reference.mod)
+    sc.do_symca(names)
+    assert [cc.name for cc in sc.CC] == names
+    for name in names:
+        assert np.isclose(getattr(sc, name).value,
+                          getattr(reference, name).value)
+
+    # the symbols of build_cc_matrix can be used as names as well
+    symbols = list(SMCAtools.build_cc_matrix(
+        reference.fluxes,
+        reference.fluxes_independent,
+        reference.species_independent,
+        reference.fluxes_dependent,
+        reference.species_dependent
+    ))
+    sc = make_symca(reference.mod)
+    sc.do_symca([symbols[0], symbols[3]])
+    assert [cc.name for cc in sc.CC] == [str(symbols[0]), str(symbols[3])]
+    assert np.isclose(sc.CC[1].value,
+                      getattr(reference, str(symbols[3])).value)
+    with pytest.raises(ValueError) as error:
+        sc.do_symca([symbols[0], Symbol('ccJR9_R1')])
+    assert 'ccJR9_R1' in str(error.value)
+
+
+@pytest.mark.parametrize('kind', ['branched', 'cycle'])
+def test_pysces(kind, tmpdir):
+    pytest.importorskip('pysces')
+    mod = SymcaBenchmark.load_network(kind, 4, str(tmpdir), use_pysces=True)
+    mod.SetQuiet()
+    sc = make_symca(mod)
+    sc.do_symca()
+    assert sc.check_cc() == []
+
+
+def test_empty_targeted(tmpdir):
+    sc = make_symca(random_model(random.Random(1), 'branched', 3,
+                                 str(tmpdir)))
+    sc.do_symca([])
+    assert sc.CC == []
+    for function in (sc.cc_matrix, sc.check_cc,
+                     lambda: sc.gridscan(['p'], [[1.0]])):
+        with pytest.raises(RuntimeError):
+            function()
+
+
+def test_gridscan(scanned):
+    mod = scanned.mod
+    mod.q = 1.0
+    parameters = ['q', 'p']
+    scan_ranges = [[1.0, 2.0], [0.5, 1.0, 2.0]]
+    results = scanned.gridscan(parameters, scan_ranges, init_return=True)
+    assert mod.p == 1.0
+    assert sorted(results) == sorted(cc.name for cc in scanned.CC)
+    for cc in scanned.CC:
+        expected = cc.gridscan(parameters, scan_ranges, init_return=True)
+        assert results[cc.name].shape == (2, 3, cc.pattern_count)
+        assert np.allclose(results[cc.name], expected)
+        # parscan is the same scan along a single parameter
+        scan = cc.parscan('p', scan_ranges[1], init_return=True)
+        assert np.allclose(results[cc.name][0], scan[:, 1:])
+
+
+def test_refresh(tmpdir):
+    mod = random_model(random.Random(1), 'branched', 3, str(tmpdir))
+    sc = make_symca(mod)
+    sc.do_symca()
+    kmatrix, lmatrix = sc.kmatrix, sc.lmatrix
+    es_matrix, ematrix = sc.es_matrix, sc.ematrix
+    scaled_k = sc.scaled_k
+    generation = sc.generation
+    values = [cc.value for cc in sc.CC]
+
+    # new nonzero values keep every matrix
+    mod.elas_var = mod.elas_var * 2
+    mod.doMca()
+    assert sc.refresh() == []
+    assert sc.kmatrix is kmatrix and sc.lmatrix is lmatrix
+    assert sc.es_matrix is es_matrix and sc.ematrix is ematrix
+    # the replaced array starts a new generation
+    assert sc.generation == generation + 1
+    assert not np.allclose([cc.value for cc in sc.CC], values)
+    assert sc.check_cc() == []
+
+    # a zero elasticity only rebuilds what depends on es_matrix
+    mod.ecR1_S1 = 0
+    mod.doMca()
+    assert sc.refresh() == ['es_matrix']
+    assert sc.es_matrix is not es_matrix
+    assert Symbol('ecR1_S1') in es_matrix.free_symbols
+    assert Symbol('ecR1_S1') not in sc.es_matrix.free_symbols
+    assert sc.ematrix is not ematrix
+    assert sc.kmatrix is kmatrix and sc.lmatrix is lmatrix
+    assert sc.scaled_k is scaled_k
+
+
+@pytest.fixture
+def counting_backend():
+    """Registers the backend 'counting', the sympy backend that also
+    appends every expression it simplifies to the returned list"""
+    calls = []
+
+    def factor_element(expression, path_to):
+        calls.append(expression)
+        return SMCAtools._sympy_factor_element(expression, path_to)
+
+    SMCAtools.register_backend('counting', factor_element)
+    yield calls
+    del SMCAtools.backends['counting']
+
+
+def interrupted_run(mod, count):
+    """Stops iter_symca after count control coefficients and returns the
+    directory of its checkpoint"""
+    sc = make_symca(mod, backend='counting', checkpoint=True)
+    run = sc.iter_symca()
+    for i in range(count):
+        next(run)
+    run.close()
+    checkpoint = sc._checkpoint(sc.cache_key())
+    assert path.exists(checkpoint.directory)
+    return checkpoint
+
+
+@pytest.mark.parametrize('truncate', [False, True])
+def test_resume_checkpoint(tmpdir, counting_backend, truncate):
+    mod = random_model(random.Random(3), 'branched', 3, str(tmpdir))
+    fresh = make_symca(mod, backend='counting')
+    fresh.do_symca()
+    fresh_calls = len(counting_backend)
+
+    checkpoint = interrupted_run(mod, 5)
+    elements = path.join(checkpoint.directory, checkpoint._elements_file)
+    if truncate:
+        # a crash while the last element was written
+        size = path.getsize(elements)
+        with open(elements, 'r+b') as f:
+            f.truncate(size - 5)
+    done = len(SymcaCheckpoint(checkpoint.directory,
+                               checkpoint.options).elements())
+    assert 5 - truncate <= done < fresh_calls - 1
+
+    del counting_backend[:]
+    resumed = make_symca(mod, backend='counting', checkpoint=True)
+    resumed.do_symca()
+    names = [stage['name'] for stage in resumed.profile['stages']]
+    assert 'invert' not in names
+    # only the elements that were not stored are factored
+    assert len(counting_backend) == fresh_calls - 1 - done
+    assert not path.exists(checkpoint.directory)
+
+    assert [cc.name for cc in resumed.CC] == [cc.name for cc in fresh.CC]
+    for cc, expected in zip(resumed.CC, fresh.CC):
+        assert (cc.numerator - expected.numerator).expand() == 0
+    assert np.allclose(resumed.cc_matrix(), fresh.cc_matrix())
+    assert resumed.check_cc() == []
+
+
+def test_checkpoint_truncated_record(tmpdir):
+    directory = str(tmpdir.join('checkpoint'))
+    checkpoint = SymcaCheckpoint(directory, 'options')
+    for i in range(3):
+        checkpoint.add_element(i, 'element %d' % i)
+    checkpoint.close()
+    elements = path.join(directory, checkpoint._elements_file)
+    with open(elements, 'r+b') as f:
+        f.truncate(path.getsize(elements) - 3)
+
+    checkpoint = SymcaCheckpoint(directory, 'options')
+    assert checkpoint.elements() == {0: 'element 0', 1: 'element 1'}
+    # the incomplete record is replaced
+    checkpoint.add_element(2, 'element 2')
+    checkpoint.close()
+    assert SymcaCheckpoint(directory, 'options').elements() == {
+        0: 'element 0', 1: 'element 1', 2: 'element 2'
+    }
+
+
+def test_checkpoint_other_options(tmpdir):
+    directory = str(tmpdir.join('checkpoint'))
+    checkpoint = SymcaCheckpoint(directory, ('1', 'sympy'))
+    checkpoint.save('invert', 'inverted')
+    checkpoint.add_element(0, 'element')
+    checkpoint.close()
+    assert SymcaCheckpoint(directory, ('1', 'sympy')).load('invert') == (
+        'inverted'
+    )
+
+    other = SymcaCheckpoint(directory, ('1', 'maxima'))
+    assert other.load('invert') is None
+    assert other.elements() == {}
+    assert not path.exists(directory)